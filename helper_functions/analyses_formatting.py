@@ -1,70 +1,61 @@
+import time
+import numpy as np
 import pandas as pd
 from .hardcoded_values import produkte_dict
+from .parallel_processing import execute_tasks
 
 def renumber_pairs(column):
     # To recognize clusters I have a continous cluster-id, e.g. 1,1,2,2,3,3, but due to filtering there are some gaps, 1,1,3,3, ...
     # this will just renumber it to 1,1,2,2
     # numbers dont even have to be in ascending order, e.g. if i sorted dataframe by name before and cluster_ids become 3,3,1,1,2,2
     # will just respect the order of appearance and re-number starting with 1.
-    mapping = {}
-    new_id = 1
+    return pd.factorize(column)[0] + 1
 
-    for val in column:
-        if val not in mapping:
-            mapping[val] = new_id
-            new_id += 1
 
-    new_values = [mapping[val] for val in column]
-    return new_values
-
-
-
-def renumber_and_sort_alphanumeric(df, column='cluster_id'):    # Split the column into two
-    # Split the column into two
-    df['num'] = df[column].str.split('_').str[0]
-    df['alpha'] = df[column].str.split('_').str[1]
-    df['num'] = df['num'].astype(int)
+def renumber_and_sort_alphanumeric(df, column='cluster_id'):
+    # Split the column into two (one pass), e.g. 12_b -> 12, b
+    parts = df[column].str.split('_', expand=True).reindex(columns=[0, 1])
+    keys = pd.DataFrame({'num': parts[0].astype(int).to_numpy(), 'alpha': parts[1].to_numpy()})
 
     # Sort the dataframe
-    df.sort_values(['num', 'alpha'], inplace=True)
+    keys = keys.sort_values(['num', 'alpha'])
+    df = df.take(keys.index)
 
-    # Create a new column with rank
-    df['rank'] = df['num'].rank(method='dense').astype(int)
+    # Rank of num, after sorting simply the order of appearance
+    rank = pd.Series(pd.factorize(keys['num'])[0] + 1, index=df.index)
 
     # Combine 'rank' and 'alpha' to get the desired format
-    df[column] = df['rank'].astype(str) + '_' + df['alpha']
-
-    # Drop the temporary columns
-    df.drop(['num', 'alpha', 'rank'], axis=1, inplace=True)
+    df[column] = rank.astype(str) + '_' + pd.Series(keys['alpha'].to_numpy(), index=df.index)
 
     return df
 
 
-def set_master_flag(df):
-    if "cluster_id" not in df.columns:
-        raise ValueError("DataFrame does not contain 'cluster_id' column.")
+def master_flag_columns(df):
+    """
+    Returns the columns "master" ("X" for the row with highest score / newest CreatedAt per cluster_id, else "")
+    and "masterID" (ReferenceID of the master of the cluster), aligned with df.
+    """
+    keys = df[["score", "CreatedAt", "cluster_id", "ReferenceID"]].reset_index(drop=True)
 
-    # Create a copy to avoid modifying the original DataFrame
-    result_df = df.copy()
+    # Sort by 'score' and 'CreatedAt' in descending order for processing, first row per cluster is the master
+    sorted_keys = keys.sort_values(by=["score", "CreatedAt"], ascending=[False, False])
+    is_master = ~sorted_keys["cluster_id"].duplicated() & sorted_keys["cluster_id"].notna()
 
-    # Sort by 'score' and 'CreatedAt' in descending order for processing
-    sorted_df = result_df.sort_values(by=["score", "CreatedAt"], ascending=[False, False])
+    # Handle the case where no row has a cluster_id
+    if len(sorted_keys) and not is_master.any():
+        is_master.iloc[0] = True  # Mark the first row as 'master'
 
-    # Group by 'cluster_id' and mark the first row in each group as 'X' and others as ''
-    sorted_df["master"] = sorted_df.groupby("cluster_id").cumcount().map({0: "X"}).fillna("")
+    master = pd.Series(np.where(is_master.sort_index(), "X", ""), index=df.index)
+    master_ids = sorted_keys[is_master].set_index("cluster_id")["ReferenceID"]
+    return master, df["cluster_id"].map(master_ids)
 
-    # Handle the case where all rows have the same 'cluster_id'
-    if sorted_df["master"].eq("").all():
-        sorted_df["master"].iloc[0] = "X"  # Mark the first row as 'master'
 
-    # Assign the 'master' column directly to the original DataFrame
-    result_df["master"] = sorted_df["master"]
-    
-    # Create the 'master_ID' column
-    master_ids = sorted_df[sorted_df["master"] == "X"].set_index("cluster_id")["ReferenceID"]
-    result_df["masterID"] = result_df["cluster_id"].map(master_ids)
+def set_master_flag(df):
+    if "cluster_id" not in df.columns:
+        raise ValueError("DataFrame does not contain 'cluster_id' column.")
 
-    return result_df
+    master, master_id = master_flag_columns(df)
+    return df.assign(master=master, masterID=master_id)
 
 
 def add_organisationsrollen_string_columns(df1, df2, rolle="Organisationsrollen", rolle_id="Organisationrollen_ProduktID"):
@@ -79,30 +70,49 @@ def add_organisationsrollen_string_columns(df1, df2, rolle="Organisationsrollen"
     if rolle_id not in df1.columns:
         df1[rolle_id] = [[] for _ in range(len(df1))]
 
-    # Iterate over each row in df1
-    for idx, row in df1.iterrows():
-        # Check for matches in df2
-        for ref_id in ['Inhaber_RefID', 'Rechnungsempfaenger_RefID', 'Korrespondenzempfaenger_RefID']:
-            matched_rows = df2[df2[ref_id] == row['ReferenceID']]
-            for _, matched_row in matched_rows.iterrows():
-                role = ref_id.split('_')[0]  # Extracts the role from the column name
-                fullid_value = produkte_dict.get(matched_row['FullID'], matched_row['FullID'])
-                df1.at[idx, rolle].append(f"{role} ({fullid_value})")
-                df1.at[idx, rolle_id].append(matched_row['Produkt_RefID'])
+    # Long table of (role column, Produkt) per ReferenceID, in order of role columns, then rows of df2
+    ref_columns = ['Inhaber_RefID', 'Rechnungsempfaenger_RefID', 'Korrespondenzempfaenger_RefID']
+    long_df = df2.melt(
+        id_vars=['FullID', 'Produkt_RefID'], value_vars=ref_columns, var_name='ref_column', value_name='ReferenceID'
+    )
+    long_df = long_df[long_df['ReferenceID'].isin(df1['ReferenceID'])]
+
+    role = long_df['ref_column'].str.split('_').str[0]  # Extracts the role from the column name
+    fullid_value = long_df['FullID'].map(produkte_dict).fillna(long_df['FullID'])
+    long_df = long_df.assign(label=role + ' (' + fullid_value + ')')
+    grouped = long_df.groupby('ReferenceID', sort=False)[['label', 'Produkt_RefID']].agg(list)
+
+    labels = df1['ReferenceID'].map(grouped['label'])
+    produkt_ids = df1['ReferenceID'].map(grouped['Produkt_RefID'])
+    df1[rolle] = [
+        existing + (new if isinstance(new, list) else []) for existing, new in zip(df1[rolle], labels)
+    ]
+    df1[rolle_id] = [
+        existing + (new if isinstance(new, list) else []) for existing, new in zip(df1[rolle_id], produkt_ids)
+    ]
 
     return df1
 
 
-def filter_verknuepfungen(row):
+def filter_verknuepfungen(df):
     """
     For Organisations-analyses we only want to show Verknüpfungen to Personen. 
-    This filters out anything from the list that is not 'Mitarbeiter' or 'Administrator'
+    This filters out anything from the lists that is not 'Mitarbeiter' or 'Administrator' (on an exploded view of the three list columns).
     """
-    filtered_indices = [i for i, x in enumerate(row['Verknuepfungsart_list']) if x in ['Mitarbeiter', 'Administrator']]
-    row['Verknuepfungsart_list'] = [row['Verknuepfungsart_list'][i] for i in filtered_indices]
-    row['VerknuepftesObjektID_list'] = [row['VerknuepftesObjektID_list'][i] for i in filtered_indices]
-    row['VerknuepftesObjekt_list'] = [row['VerknuepftesObjekt_list'][i] for i in filtered_indices]
-    return row
+    list_columns = ['Verknuepfungsart_list', 'VerknuepftesObjektID_list', 'VerknuepftesObjekt_list']
+    if df.empty:
+        return df.copy()
+    exploded = df[list_columns].reset_index(drop=True).explode(list_columns)
+    exploded = exploded[exploded['Verknuepfungsart_list'].isin(['Mitarbeiter', 'Administrator'])]
+
+    # exploded rows are still in row order, so the kept elements can be cut back into per-row lists
+    boundaries = np.cumsum(np.bincount(exploded.index, minlength=len(df)))[:-1]
+    return df.assign(
+        **{
+            column: [values.tolist() for values in np.split(exploded[column].to_numpy(dtype=object), boundaries)]
+            for column in list_columns
+        }
+    )
 
 
 def final_touch(df, cols_to_keep, two_roles=False, alphanumeric=False):
@@ -113,13 +123,13 @@ def final_touch(df, cols_to_keep, two_roles=False, alphanumeric=False):
     if "cluster_id" not in df.columns:
         raise ValueError("DataFrame does not contain 'cluster_id' column.")
     
-    df = df.apply(filter_verknuepfungen, axis=1)
-    df = set_master_flag(df)
+    df = filter_verknuepfungen(df)
+    df["master"], df["masterID"] = master_flag_columns(df)
     df = df[cols_to_keep]
     df["score"] = df["score"].astype(int)
     
     if two_roles or alphanumeric:
-        df = renumber_and_sort_alphanumeric(df.copy(), column='cluster_id')
+        df = renumber_and_sort_alphanumeric(df, column='cluster_id')
     else:
         df["cluster_id"] = df["cluster_id"].astype(int)
         df["cluster_id"] = renumber_pairs(df["cluster_id"])
@@ -129,67 +139,86 @@ def final_touch(df, cols_to_keep, two_roles=False, alphanumeric=False):
     return df
 
 
-def final_touch_batch(df_dict, cols_to_keep, two_roles=False, alphanumeric=False):
+def final_touch_task(df, cols_to_keep, two_roles=False, alphanumeric=False):
+    # Worker of final_touch_batch(), also returns the wall time.
+    start_time = time.time()
+    result = final_touch(df, cols_to_keep, two_roles, alphanumeric=alphanumeric)
+    return result, time.time() - start_time
+
+
+def final_touch_batch(df_dict, cols_to_keep, two_roles=False, alphanumeric=False, backend="process", num_workers=None):
     """
-    Processes any number of dataframes at once.
+    Processes any number of dataframes at once, concurrently on a worker pool (largest first, see execute_tasks()).
     Expects a dictionary, with the Description as key and the dataframe or nested dictionary of dataframes as value, as well as the columns to keep.
     Returns a dictionary with key = description and value = dataframe or nested dictionary of dataframes.
     """
-    result_dict = {}
+    # one task per dataframe, (produktname, name) with name None for a single dataframe
+    task_keys = []
+    tasks = []
     for produktname, value in df_dict.items():
         if isinstance(value, dict):  # Check if the value is a nested dictionary
-            nested_result = {}
             for name, df in value.items():
-                nested_result[name] = final_touch(df, cols_to_keep, two_roles, alphanumeric=alphanumeric)
-            result_dict[produktname] = nested_result
+                task_keys.append((produktname, name))
+                tasks.append(df)
         else:  # If the value is a single dataframe
-            result_dict[produktname] = final_touch(value, cols_to_keep, two_roles, alphanumeric=alphanumeric)
+            task_keys.append((produktname, None))
+            tasks.append(value)
+
+    results = execute_tasks(
+        final_touch_task,
+        tasks,
+        weights=[len(df) for df in tasks],
+        backend=backend,
+        num_workers=num_workers,
+        tasks_per_worker=None,
+        cols_to_keep=cols_to_keep,
+        two_roles=two_roles,
+        alphanumeric=alphanumeric,
+    )
+
+    result_dict = {}
+    wall_times = {}
+    for (produktname, name), (result, wall_time) in zip(task_keys, results):
+        wall_times[produktname] = wall_times.get(produktname, 0) + wall_time
+        if name is None:
+            result_dict[produktname] = result
+        else:
+            result_dict.setdefault(produktname, {})[name] = result
+    for produktname, value in df_dict.items():
+        if isinstance(value, dict) and not value:
+            result_dict[produktname] = {}
+        print(f"{produktname}: {wall_times.get(produktname, 0):.1f}s")
 
-    return result_dict
+    return {produktname: result_dict[produktname] for produktname in df_dict}
 
 
 from .hardcoded_values import produkte_dict_element_typ
 
 def organisationsrollen_add_inhaber_typ_and_produkt_typ(df_rollen, df_personen, df_organisationen):
-    # Create a set for faster lookup
-    personen_ids = set(df_personen["ReferenceID"])
-    organisationen_ids = set(df_organisationen["ReferenceID"])
-    
-    def get_typ(ref_id):
-        if ref_id in personen_ids:
-            return "Person"
-        elif ref_id in organisationen_ids:
-            return "Organisation"
-        else:
-            return "Unbekannt"
-    
-    def get_produkt_typ(full_id):
-        return produkte_dict_element_typ.get(full_id, None)
-    def get_produkt_name(full_id):
-        return produkte_dict.get(full_id, None)
-    
-    df_rollen["Inhaber_Typ"] = df_rollen["Inhaber_RefID"].apply(get_typ)
-    df_rollen["Rechnungsempfaenger_Typ"] = df_rollen["Rechnungsempfaenger_RefID"].apply(get_typ)
-    df_rollen["Korrespondenzempfaenger_Typ"] = df_rollen["Korrespondenzempfaenger_RefID"].apply(get_typ)
-    df_rollen["Produkt_Typ"] = df_rollen["FullID"].apply(get_produkt_typ)
-    df_rollen["Produkt_Name"] = df_rollen["FullID"].apply(get_produkt_name)
-    
+    # Hashed lookup of all IDs at once
+    personen_ids = df_personen["ReferenceID"].unique()
+    organisationen_ids = df_organisationen["ReferenceID"].unique()
+
+    typ_columns = ["Inhaber_Typ", "Rechnungsempfaenger_Typ", "Korrespondenzempfaenger_Typ"]
+    for typ_column in typ_columns:
+        ref_ids = df_rollen[typ_column.replace("_Typ", "_RefID")]
+        df_rollen[typ_column] = np.select(
+            [ref_ids.isin(personen_ids), ref_ids.isin(organisationen_ids)],
+            ["Person", "Organisation"],
+            default="Unbekannt",
+        )
+    df_rollen["Produkt_Typ"] = df_rollen["FullID"].map(produkte_dict_element_typ)
+    df_rollen["Produkt_Name"] = df_rollen["FullID"].map(produkte_dict)
+
     # The following is just a check if there are rows with a mixture of Person and Organisation:
     # Filter out rows where any of the types is 'Unbekannt'
-    filtered_df = df_rollen[
-        (df_rollen["Inhaber_Typ"] != "Unbekannt") &
-        (df_rollen["Rechnungsempfaenger_Typ"] != "Unbekannt") &
-        (df_rollen["Korrespondenzempfaenger_Typ"] != "Unbekannt") &
-        (df_rollen["Produkt_Typ"] != "Unbekannt")
-    ]
-    
+    typen = df_rollen[typ_columns]
+    known = typen.ne("Unbekannt").all(axis=1) & (df_rollen["Produkt_Typ"] != "Unbekannt")
+
     # Count rows where there is a mixture of 'Person' and 'Organisation'
-    def is_mixed(row):
-        types = {row["Inhaber_Typ"], row["Rechnungsempfaenger_Typ"], row["Korrespondenzempfaenger_Typ"]}
-        return "Person" in types and "Organisation" in types
-    
-    mixed_typ_count = filtered_df.apply(is_mixed, axis=1).sum()
-    
+    is_mixed = typen.eq("Person").any(axis=1) & typen.eq("Organisation").any(axis=1)
+    mixed_typ_count = int((known & is_mixed).sum())
+
     print(f"Number of rows with a mixture of 'Person' and 'Organisation': {mixed_typ_count}")
     
     
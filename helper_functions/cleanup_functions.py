@@ -76,6 +76,108 @@ def normalize_string(string_in):
     return normalized
 
 
+def hash_key(series):
+    # 64-bit hash of each value, so that groupings can be done on integer keys instead of strings.
+    # Missing values stay missing (<NA>), so that groupby drops them like it did for the strings.
+    hashes = pd.util.hash_pandas_object(series.fillna("").astype(str), index=False).astype("UInt64")
+    return hashes.mask(series.isna().to_numpy()).array
+
+
+def fold_diacritics(series):
+    # Lowercase and fold umlauts and diacritics ("Müller" / "Mueller" -> "mueller", "René" -> "rene"), result is ASCII.
+    return (
+        series.str.casefold()
+        .str.translate(str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"}))
+        .str.normalize("NFKD")
+        .str.encode("ascii", errors="ignore")
+        .str.decode("ascii")
+    )
+
+
+def check_block_sizes(df, column, max_pairs=20_000_000, max_block_size=None, on_oversized="raise"):
+    """
+    Pre-flight check before a self-merge or groupby on column: a single degenerate value (e.g. a placeholder
+    phone number) would otherwise produce block_size * (block_size - 1) pairs.
+    Computes the key-frequency histogram and the predicted number of pairs. Two budgets, both optional (None):
+    max_block_size per block, every block larger than that is oversized, and max_pairs for the total,
+    the largest blocks are oversized until the predicted pairs of the rest fit into it.
+    on_oversized="raise" (default) raises a ValueError, "ignore" only reports,
+    "cap" drops the rows of oversized blocks (i.e. their matches are missing in the output).
+    Returns the (filtered) df and a report of the oversized blocks (column, key, block_size, pairs).
+    """
+    block_sizes = df[column].value_counts()
+    block_sizes = block_sizes[block_sizes > 1]
+    pairs = block_sizes * (block_sizes - 1)
+
+    # pairs that remain if this and all larger blocks are dropped
+    remaining = pairs.sum() - pairs.cumsum()
+    oversized = pd.Series(False, index=pairs.index)
+    if max_pairs is not None:
+        oversized |= remaining + pairs > max_pairs
+    if max_block_size is not None:
+        oversized |= block_sizes > max_block_size
+
+    report = pd.DataFrame(
+        {
+            "column": column,
+            "key": block_sizes.index[oversized],
+            "block_size": block_sizes[oversized].values,
+            "pairs": pairs[oversized].values,
+        }
+    )
+    if report.empty:
+        return df, report
+
+    message = (
+        f"{column}: {len(report)} oversized blocks with {report['pairs'].sum()} of {pairs.sum()} predicted pairs"
+    )
+    if on_oversized == "raise":
+        raise ValueError(f"{message}:\n{report.to_string(index=False)}")
+    print(f"Warning: {message}" + (", skipped." if on_oversized == "cap" else "."))
+    print(report.head(10).to_string(index=False))
+    if on_oversized == "cap":
+        df = df[~df[column].isin(report["key"])]
+    return df, report
+
+
+def add_name_variant_keys(df, name_column="Name"):
+    """
+    Computes once (vectorized) several normalized variants of the name and stores them as hashed 64-bit key columns:
+    - name_key: the name as it is (only converted to str)
+    - name_key_normalized: runs of whitespace collapsed to a single space ("hans  muster" -> "hans muster"),
+      the variants below are based on it as well
+    - name_key_abbrev: first name abbreviated, same as abbreviate_first_name() ("hans muster" -> "h. muster")
+    - name_key_swapped: first and last word swapped ("muster hans" -> "hans muster")
+    - name_key_folded: umlauts and diacritics folded ("müller" / "mueller" -> "mueller", "rené" -> "rene")
+    and address_key for address_full, email_key for EMailAdresse. Missing values get a missing key.
+    For Organisationen name_column should be "Name_Zeile2".
+    """
+    raw_names = df[name_column].where(df[name_column].isna(), df[name_column].astype(str))
+    names = raw_names.str.split().str.join(" ")
+
+    first_word = names.str.split(n=1).str[0]
+    rest = names.str.split(n=1).str[1]
+    abbreviated = names.where(
+        rest.isna() | first_word.str.endswith("."),
+        first_word.str[0] + ". " + rest,
+    )
+
+    swapped = names.str.replace(r"^(\S+)(.*\s)(\S+)$", r"\3\2\1", regex=True)
+
+    folded = fold_diacritics(names)
+
+    df["name_key"] = hash_key(raw_names)
+    df["name_key_normalized"] = hash_key(names)
+    df["name_key_abbrev"] = hash_key(abbreviated)
+    df["name_key_swapped"] = hash_key(swapped)
+    df["name_key_folded"] = hash_key(folded)
+    df["address_key"] = hash_key(df["address_full"])
+    if "EMailAdresse" in df.columns:
+        df["email_key"] = hash_key(df["EMailAdresse"])
+
+    return df
+
+
 def basic_cleanup(df, remove_personen_Sonstiges=True):
     """
     Performs some basic corrections to String formatting.
@@ -682,6 +784,10 @@ def raw_cleanup(file_paths_original, raw_data_directory, remove_personen_Sonstig
         axis=1,
     )
 
+    # Hashed name/address keys used for grouping in the Doubletten functions.
+    df_organisationen = add_name_variant_keys(df_organisationen, name_column="Name_Zeile2")
+    df_personen = add_name_variant_keys(df_personen, name_column="Name")
+
     personenservicerolle_df = load_data(file_paths["personenservicerolle"])
     organisationservicerolle_df = load_data(file_paths["organisationservicerolle"])
     df_personen = add_servicerole_column_string(df_personen, personenservicerolle_df)
@@ -1,15 +1,29 @@
 import os
 import pickle
-
-from helper_functions.hardcoded_values import produkte_dict
-from .file_io_functions import load_data
+import multiprocessing
+from difflib import SequenceMatcher
+from functools import partial
+
+from helper_functions.hardcoded_values import (
+    produkte_dict,
+    organisationsrollen_columns,
+    personenrollen_columns,
+)
+from .file_io_functions import load_data, save_cluster_tables, export_graph_arrays
+from .cleanup_functions import add_name_variant_keys, check_block_sizes, fold_diacritics
 import pandas as pd
+import numpy as np
 import networkx as nx
 
 
-def match_organizations_internally_simplified(df, personen=False):
+def match_organizations_internally_simplified(
+    df, personen=False, only_ids=None, max_pairs=20_000_000, max_block_size=None, on_oversized="raise"
+):
     # Currently used in production.
+    # only_ids: if given, only edges where source or target is in this set are generated (incremental mode).
+    # max_pairs (total per match column) / max_block_size (per block) / on_oversized: pre-flight check, see check_block_sizes().
     rows_list = []
+    reference_ids = set(df["ReferenceID"])
 
     # Handling 'VerknuepftesObjektID_list' and 'Verknuepfungsart_list'
     for i, row in df.iterrows():
@@ -22,7 +36,9 @@ def match_organizations_internally_simplified(df, personen=False):
         ):
             for target, match_type in zip(targets, match_types):
                 if not pd.isna(target) and not pd.isna(match_type):
-                    if target in df["ReferenceID"].values:
+                    if only_ids is not None and source not in only_ids and target not in only_ids:
+                        continue
+                    if target in reference_ids:
                         new_row = {
                             "source": source,
                             "target": target,
@@ -49,12 +65,34 @@ def match_organizations_internally_simplified(df, personen=False):
     for contact_type, column_name in columns_to_check:
         # Remove rows with NA values (during cleanup empty strings and "nan" must have been replaced)
         df.replace("", pd.NA, inplace=True)
-        valid_contacts = df.loc[df[column_name].notna()]
+        valid_contacts = df.loc[df[column_name].notna(), [column_name, "ReferenceID"]]
+        # Same blocks as in a full run, so that incremental and full results stay identical
+        valid_contacts, _ = check_block_sizes(
+            valid_contacts,
+            column_name,
+            max_pairs=max_pairs,
+            max_block_size=max_block_size,
+            on_oversized=on_oversized,
+        )
 
         # Self merge to find matching rows
-        merged = valid_contacts.merge(
-            valid_contacts[[column_name, "ReferenceID"]], on=column_name
-        )
+        if only_ids is None:
+            merged = valid_contacts.merge(valid_contacts, on=column_name)
+        else:
+            # Only merge the selected rows against all others, in both directions.
+            selected = valid_contacts[valid_contacts["ReferenceID"].isin(only_ids)]
+            merged = selected.merge(valid_contacts, on=column_name)
+            merged = pd.concat(
+                [
+                    merged,
+                    merged.rename(
+                        columns={
+                            "ReferenceID_x": "ReferenceID_y",
+                            "ReferenceID_y": "ReferenceID_x",
+                        }
+                    ),
+                ]
+            ).drop_duplicates(subset=["ReferenceID_x", "ReferenceID_y"])
         merged = merged[merged["ReferenceID_x"] != merged["ReferenceID_y"]]
         merged = merged.rename(
             columns={"ReferenceID_x": "source", "ReferenceID_y": "target"}
@@ -69,75 +107,99 @@ def match_organizations_internally_simplified(df, personen=False):
     return output_df
 
 
-def organisationsrollen_group_aggregate(df):
-    # Input is das raw xlsx vom Organisationsrollen query.
-    # Benutzt dictionary oben Produkt_typ als string, Count für eine Kombination aus typ/inh./rechempf/korrempf und liste der produkt-objekte zu generieren.
-    grouped_df = (
-        df.groupby(
-            [
-                "Inhaber_RefID",
-                "Rechnungsempfaenger_RefID",
-                "Korrespondenzempfaenger_RefID",
-                "FullID",
-            ]
-        )
-        .agg(
-            Produkt_count=pd.NamedAgg(column="Produkt_RefID", aggfunc="size"),
-            Produkte=pd.NamedAgg(column="ProduktObj", aggfunc=list),
-            **{
-                col: pd.NamedAgg(column=col, aggfunc="first")
-                for col in df.columns
-                if col
-                not in [
-                    "Inhaber_RefID",
-                    "Rechnungsempfaenger_RefID",
-                    "Korrespondenzempfaenger_RefID",
-                    "Produkt_RefID",
-                    "FullID",
-                    "ProduktObj",
-                ]
-            },
-        )
-        .reset_index()
-    )
+def rollen_group_aggregate(df, role_columns, dropna=True):
+    # Input is das raw xlsx vom Organisationsrollen oder Personenrollen query, role_columns siehe hardcoded_values.
+    # Aggregiert pro Kombination aus typ + rollen: Count, liste der produkt-objekte und "first" aller übrigen Kolonnen.
+    # Jede Kombination (Produktgruppe) bekommt eine integer ID als Knoten im Graph, der lesbare Label kommt in eine separate Tabelle.
+    group_columns = list(role_columns) + ["FullID"]
+    objekt_column = "ProduktObj" if "ProduktObj" in df.columns else "Produkt_RefID"
+    grouped = df.groupby(group_columns, dropna=dropna)
+
+    other_columns = [
+        col
+        for col in df.columns
+        if col not in group_columns + ["Produkt_RefID", "ProduktObj"]
+    ]
+    grouped_df = grouped[other_columns].first()
+    grouped_df.insert(0, "Produkt_count", grouped.size())
+    grouped_df.insert(1, "Produkte", grouped[objekt_column].agg(list))
+    grouped_df = grouped_df.reset_index()
 
     # Create 'Produkt_typ' by mapping 'FullID' through the data dictionary
     grouped_df["Produkt_typ"] = grouped_df["FullID"].map(produkte_dict)
 
+    # Hash of the group key instead of a running number, so that the same Produktgruppe keeps its node ID across runs
+    # (needed by the incremental mode of create_edges_and_clusters()).
+    # The hash ignores column names, so the role columns are added as a tag: Organisationsrollen and Personenrollen
+    # with the same IDs and FullID must not end up as the same node.
+    group_keys = grouped_df[group_columns].assign(rollen_tabelle=",".join(role_columns))
+    grouped_df["Produktgruppe_ID"] = (
+        pd.util.hash_pandas_object(group_keys, index=False)
+        .to_numpy()
+        .view("int64")
+    )
+
     return grouped_df
 
 
-def generate_edge_list_from_orginationsrollen_aggregate(df):
+def organisationsrollen_group_aggregate(df):
+    # Inhaber, Rechnungsempfänger, Korrespondenzempfänger. Rows with a missing role are dropped (as before).
+    return rollen_group_aggregate(df, organisationsrollen_columns)
+
+
+def personenrollen_group_aggregate(df):
+    # Kontaktperson, Technikperson, Statistikperson. Not every product has all three, so missing roles are kept.
+    return rollen_group_aggregate(df, personenrollen_columns, dropna=False)
+
+
+def produktgruppen_label_table(df):
     """
-    "source" eines edges ist kombination aus liste der objekte+produkttyp newline count. um eindeutig zu sein.
-    Für eine source gibt es jeweils 3 row / Targets (inh. rechempf. korrempf.) mit RefID und label.
-    diese edge list kann dann mit internen endge list der organisationen concateniert werden.
+    Human-readable label for each Produktgruppe node: liste der objekte + produkttyp newline count.
+    Input is the output of rollen_group_aggregate().
     """
-    edge_list = []
-    for _, row in df.iterrows():
-        source = (
-            str(row["Produkte"])
-            + str(row["Produkt_typ"])
+    label_df = pd.DataFrame(
+        {
+            "node": df["Produktgruppe_ID"],
+            "label": df["Produkte"].astype(str)
+            + df["Produkt_typ"].astype(str)
             + "\n"
-            + str([row["Produkt_count"]][0])
-        )
-        for target, target_type in [
-            (row["Rechnungsempfaenger_RefID"], "Rechnungsempfaenger"),
-            (row["Korrespondenzempfaenger_RefID"], "Korrespondenzempfaenger"),
-            (row["Inhaber_RefID"], "Inhaber"),
-        ]:
-            edge_list.append(
-                {"source": source, "target": target, "match_type": target_type}
-            )
-
-    # Create a DataFrame from the edge list
-    edges_df = pd.DataFrame(edge_list)
-    return edges_df
-
-def match_organizations_between_dataframes(d1, df2):
+            + df["Produkt_count"].astype(str),
+        }
+    )
+    return label_df.reset_index(drop=True)
+
+
+def generate_edge_list_from_rollen_aggregate(df, role_columns, known_ids=None):
+    """
+    "source" eines edges ist die Produktgruppe_ID (label siehe produktgruppen_label_table()).
+    Für eine source gibt es jeweils 1 row pro rolle / Target (z.B. inh. rechempf. korrempf.) mit RefID und label.
+    diese edge list kann dann mit internen endge list der organisationen concateniert werden.
+    known_ids: if given, only edges to these ReferenceIDs are kept (semi-join), missing roles are always dropped.
+    """
+    edges_df = df.melt(
+        id_vars="Produktgruppe_ID",
+        value_vars=list(role_columns),
+        var_name="match_type",
+        value_name="target",
+    ).rename(columns={"Produktgruppe_ID": "source"})
+    edges_df["match_type"] = edges_df["match_type"].map(role_columns)
+
+    edges_df = edges_df[edges_df["target"].notna()]
+    if known_ids is not None:
+        edges_df = edges_df[edges_df["target"].isin(known_ids)]
+
+    return edges_df[["source", "target", "match_type"]].reset_index(drop=True)
+
+
+def generate_edge_list_from_orginationsrollen_aggregate(df):
+    return generate_edge_list_from_rollen_aggregate(df, organisationsrollen_columns)
+
+
+def match_organizations_between_dataframes(d1, df2, only_ids=None):
     # Very similar to match_organizations_internally_simplified, but checks if target is present in df2.
     # Currently only finds VerknuepftesObjekt edges (no name, address, etc.)
     rows_list = []
+    reference_ids = set(df2["ReferenceID"])
 
     # Handling 'VerknuepftesObjektID_list' and 'Verknuepfungsart_list'
     for i, row in d1.iterrows():
@@ -150,7 +212,9 @@ def match_organizations_between_dataframes(d1, df2):
         ):
             for target, match_type in zip(targets, match_types):
                 if not pd.isna(target) and not pd.isna(match_type):
-                    if target in df2["ReferenceID"].values:
+                    if only_ids is not None and source not in only_ids and target not in only_ids:
+                        continue
+                    if target in reference_ids:
                         new_row = {
                             "source": source,
                             "target": target,
@@ -171,20 +235,22 @@ def cleanup_edges_df(df):
     # Directly set 'bidirectional' to True for specific match types
     df["bidirectional"] = df["match_type"].isin(["Name", "Telefon", "Email", "Adresse"])
 
-    # Step 1: Create a column with sorted tuples of 'source' and 'target'
-    df["sorted_edge"] = df.apply(
-        lambda row: tuple(sorted([row["source"], row["target"]])), axis=1
-    )
+    # Step 1: Orientation-independent edge key. Compared as strings, because Produktgruppe nodes are integers.
+    source_str = df["source"].astype(str)
+    target_str = df["target"].astype(str)
+    swap = source_str > target_str
+    df["edge_a"] = source_str.where(~swap, target_str)
+    df["edge_b"] = target_str.where(~swap, source_str)
 
-    # Group by 'sorted_edge' and 'match_type', and aggregate
+    # Group by edge key and 'match_type', and aggregate
     df = (
-        df.groupby(["sorted_edge", "match_type"])
+        df.groupby(["edge_a", "edge_b", "match_type"])
         .agg({"source": "first", "target": "first", "bidirectional": "first"})
         .reset_index()
     )
 
-    # Step 3: Remove the 'sorted_edge' column
-    df.drop("sorted_edge", axis=1, inplace=True)
+    # Step 3: Remove the edge key columns
+    df.drop(["edge_a", "edge_b"], axis=1, inplace=True)
 
     # Splitting DataFrame based on 'match_type'
     merge_df = df[df["match_type"].isin(["Name", "Telefon", "Email", "Adresse"])]
@@ -202,28 +268,105 @@ def cleanup_edges_df(df):
     return output_df
 
 
-def find_clusters_all(df, special_nodes, skip_singular_clusters=False):
+def find_hub_nodes(df, threshold=None, min_degree=100, outlier_factor=3.0):
+    """
+    Finds hub nodes per match type, e.g. a shared hotline number or an Inhaber of thousands of Produktgruppen.
+    The degree is the number of edges of that match type ("Email, Name" counts for both).
+    threshold: fixed degree (int or dict match_type -> int) above which a node is a hub.
+    If None, a node is a hub if its degree is an outlier on the log scale (above Q3 + outlier_factor * IQR
+    of its match type) and at least min_degree.
+    Returns a report with node, match_type, degree and threshold, one row per hub and match type.
+    """
+    types = df[["source", "target"]].assign(match_type=df["match_type"].str.split(", "))
+    types = types.explode("match_type", ignore_index=True)
+    ends = pd.concat(
+        [
+            types[["source", "match_type"]].rename(columns={"source": "node"}),
+            types[["target", "match_type"]].rename(columns={"target": "node"}),
+        ],
+        ignore_index=True,
+    )
+    degree = ends.groupby(["node", "match_type"], sort=False).size().rename("degree")
+    degree = degree.reset_index()
+    if degree.empty:
+        return pd.DataFrame(columns=["node", "match_type", "degree", "threshold"])
+
+    if threshold is None:
+        log_degree = np.log10(degree["degree"])
+        quartiles = log_degree.groupby(degree["match_type"]).quantile([0.25, 0.75]).unstack()
+        cutoff = 10 ** (quartiles[0.75] + outlier_factor * (quartiles[0.75] - quartiles[0.25]))
+        degree["threshold"] = degree["match_type"].map(cutoff).clip(lower=min_degree)
+    elif isinstance(threshold, dict):
+        degree["threshold"] = degree["match_type"].map(threshold).fillna(np.inf)
+    else:
+        degree["threshold"] = threshold
+
+    hubs = degree[degree["degree"] > degree["threshold"]]
+    hubs = hubs.sort_values(["match_type", "degree"], ascending=[True, False])
+    return hubs.reset_index(drop=True)
+
+
+def hub_edge_mask(df, hubs):
+    """
+    An edge is cut if one of its nodes is a hub for all match types of that edge
+    (a shared Telefon is cut, but Name + Telefon is kept).
+    Returns boolean Series (cut, source_is_hub, target_is_hub) aligned to df.
+    """
+    false = pd.Series(False, index=df.index)
+    if hubs is None or hubs.empty or df.empty:
+        return false, false, false
+
+    types = pd.DataFrame(
+        {
+            "edge": df.index,
+            "source": df["source"].values,
+            "target": df["target"].values,
+            "match_type": df["match_type"].str.split(", ").values,
+        }
+    ).explode("match_type", ignore_index=True)
+    hub_index = pd.MultiIndex.from_frame(hubs[["node", "match_type"]])
+    types["source_is_hub"] = pd.MultiIndex.from_arrays(
+        [types["source"], types["match_type"]]
+    ).isin(hub_index)
+    types["target_is_hub"] = pd.MultiIndex.from_arrays(
+        [types["target"], types["match_type"]]
+    ).isin(hub_index)
+    per_edge = types.groupby("edge", sort=False)[["source_is_hub", "target_is_hub"]].all()
+
+    source_is_hub = per_edge["source_is_hub"].reindex(df.index, fill_value=False)
+    target_is_hub = per_edge["target_is_hub"].reindex(df.index, fill_value=False)
+    return source_is_hub | target_is_hub, source_is_hub, target_is_hub
+
+
+def find_clusters_all(df, special_nodes, skip_singular_clusters=False, hubs=None):
     """
     Here we use the networkx package for graph-based analyses.
     Input is the df generated by the function "match_organizations_internally",
     or any df that has a source, target and label column.
     Special_nodes is a set of nodes that should not be considered as central nodes nor included in cluster sizes.
+    hubs is the report of find_hub_nodes(): edges cut by hub_edge_mask() do not merge components,
+    the hub is listed in the hub_nodes column of the clusters it was cut from (for display) and is treated like a special node.
     Note: this finds all clusters, i.e. nodes that just have any kind of connection. They are not necessarily Doubletten!
     """
+    cut, source_is_hub, target_is_hub = hub_edge_mask(df, hubs)
+    if hubs is not None and not hubs.empty:
+        special_nodes = set(special_nodes) | set(hubs["node"])
+
     # Create a new graph from edge list
     G = nx.from_pandas_edgelist(
-        df, "source", "target", edge_attr="match_type", create_using=nx.Graph()
+        df[~cut], "source", "target", edge_attr="match_type", create_using=nx.Graph()
     )
+    # nodes that are only connected by cut edges remain as their own clusters
+    G.add_nodes_from(pd.concat([df.loc[cut, "source"], df.loc[cut, "target"]]).unique())
 
     # Find connected components
     connected_components = nx.connected_components(G)
 
     # Collect connected components (clusters) in a list
     clusters = []
+    node_to_cluster = {}
     for i, component in enumerate(connected_components):
         # note: if singular clusters are skipped, i count may not be continuous.
-        subgraph = G.subgraph(component)
-
         # Filter out the special nodes
         filtered_nodes = [node for node in component if node not in special_nodes]
 
@@ -232,8 +375,9 @@ def find_clusters_all(df, special_nodes, skip_singular_clusters=False):
             continue
 
         # Finding the most central node based on degree
+        # (a component contains all neighbours of its nodes, so the degree in G is the degree in the subgraph)
         central_node = (
-            max((node for node in subgraph.degree(filtered_nodes)), key=lambda x: x[1])[
+            max((node for node in G.degree(filtered_nodes)), key=lambda x: x[1])[
                 0
             ]
             if filtered_nodes
@@ -249,16 +393,271 @@ def find_clusters_all(df, special_nodes, skip_singular_clusters=False):
                 "central_node": central_node,
             }
         )
+        node_to_cluster.update(dict.fromkeys(component, i))
 
     # Convert to DataFrame for better visualization and further analysis
-    cluster_df = pd.DataFrame(clusters)
+    cluster_df = pd.DataFrame(
+        clusters, columns=["cluster_id", "nodes", "cluster_size", "central_node"]
+    )
+
+    # cut hubs are shown in every cluster of their neighbours
+    hub_display = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "hub": df.loc[source_is_hub, "source"],
+                    "node": df.loc[source_is_hub, "target"],
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "hub": df.loc[target_is_hub, "target"],
+                    "node": df.loc[target_is_hub, "source"],
+                }
+            ),
+        ],
+        ignore_index=True,
+    )
+    hub_display["cluster_id"] = hub_display["node"].map(node_to_cluster)
+    hub_display = hub_display[
+        hub_display["cluster_id"].notna()
+        & (hub_display["hub"].map(node_to_cluster) != hub_display["cluster_id"])
+    ].drop_duplicates(["cluster_id", "hub"])
+    hub_nodes = hub_display.groupby("cluster_id", sort=False)["hub"].agg(list)
+    cluster_df["hub_nodes"] = [
+        hub_nodes.get(cluster_id, []) for cluster_id in cluster_df["cluster_id"]
+    ]
 
     return cluster_df
 
 
-def create_edges_and_clusters(file_paths):
-    # Main function that calls all those above. Finds ALL clusters that are connected (not just Dubletten), used for visualization.
-    
+def record_fingerprints(df):
+    """
+    One hash per ReferenceID over all columns that can produce an edge or a link.
+    Stored together with the clusters, so that the next run of create_edges_and_clusters(incremental=True)
+    can tell which records were added, changed or deleted.
+    """
+    columns = [
+        "VerknuepftesObjektID_list",
+        "Verknuepfungsart_list",
+        "Telefonnummer",
+        "EMailAdresse",
+        "Name",
+        "Name_Zeile2",
+        "address_full",
+        "Objekt_link",
+    ]
+    columns = [col for col in columns if col in df.columns]
+    hashes = pd.util.hash_pandas_object(df[columns].astype(str), index=False)
+    return pd.Series(hashes.values, index=df["ReferenceID"].values)
+
+
+def update_clusters(cluster_df, edges_df, dirty_nodes, special_nodes, hubs=None):
+    """
+    Incremental version of find_clusters_all().
+    Only clusters that contain a dirty node (added, changed, deleted or touched by an added/removed edge) are recomputed,
+    all other clusters are kept as they are, including their cluster_id.
+    A recomputed cluster inherits the cluster_id of the old cluster it shares the most nodes with, otherwise it gets a new cluster_id.
+    Edges whose cut status changed (see hub_edge_mask()) must have dirty endpoints as well.
+    """
+    old_nodes = cluster_df[["cluster_id", "nodes"]].explode("nodes")
+    dirty_cluster_ids = set(
+        old_nodes.loc[old_nodes["nodes"].isin(dirty_nodes), "cluster_id"]
+    )
+    old_nodes = old_nodes[old_nodes["cluster_id"].isin(dirty_cluster_ids)]
+
+    # Every edge that leaves this region must have been added, removed or cut, so its endpoints are dirty as well.
+    region_nodes = set(old_nodes["nodes"]) | set(dirty_nodes)
+    region_edges = edges_df[
+        edges_df["source"].isin(region_nodes) | edges_df["target"].isin(region_nodes)
+    ]
+    new_clusters = find_clusters_all(region_edges, special_nodes, hubs=hubs)
+    # hubs outside the region are only reached by cut edges, their own cluster is kept as it is
+    new_clusters = new_clusters[
+        new_clusters["nodes"].map(lambda nodes: not region_nodes.isdisjoint(nodes))
+    ].copy()
+    if new_clusters.empty:
+        # same order as below, so that positional consumers get a deterministic frame
+        output_df = cluster_df[~cluster_df["cluster_id"].isin(dirty_cluster_ids)]
+        return output_df.sort_values("cluster_id").reset_index(drop=True)
+
+    # Match new clusters to old ones by the number of shared nodes, largest overlap first.
+    new_nodes = new_clusters[["cluster_id", "nodes"]].explode("nodes")
+    overlap = (
+        new_nodes.merge(old_nodes, on="nodes", suffixes=("", "_old"))
+        .groupby(["cluster_id", "cluster_id_old"])
+        .size()
+        .reset_index(name="shared_nodes")
+        .sort_values(["shared_nodes", "cluster_id_old"], ascending=[False, True])
+    )
+    id_mapping = {}
+    used_old_ids = set()
+    for new_id, old_id in zip(overlap["cluster_id"], overlap["cluster_id_old"]):
+        if new_id not in id_mapping and old_id not in used_old_ids:
+            id_mapping[new_id] = old_id
+            used_old_ids.add(old_id)
+
+    next_id = int(cluster_df["cluster_id"].max()) + 1 if not cluster_df.empty else 0
+    for new_id in new_clusters["cluster_id"]:
+        if new_id not in id_mapping:
+            id_mapping[new_id] = next_id
+            next_id += 1
+    new_clusters["cluster_id"] = new_clusters["cluster_id"].map(id_mapping)
+
+    output_df = pd.concat(
+        [cluster_df[~cluster_df["cluster_id"].isin(dirty_cluster_ids)], new_clusters],
+        ignore_index=True,
+    )
+    output_df.sort_values("cluster_id", inplace=True)
+    output_df.reset_index(drop=True, inplace=True)
+    return output_df
+
+
+def update_edges(
+    previous_edges,
+    df_personen,
+    df_organisationen,
+    edges_organisationsrollen,
+    affected_ids,
+    max_pairs=20_000_000,
+    max_block_size=None,
+    on_oversized="raise",
+):
+    """
+    Incremental version of the edge generation in create_edges_and_clusters().
+    Edges touching an affected ReferenceID are removed and regenerated, all others are taken over from the previous run.
+    max_pairs, max_block_size and on_oversized are passed on to match_organizations_internally_simplified().
+    Organisationsrollen/Personenrollen edges are always regenerated (cheap) and compared with the previous ones.
+    Returns the new edge list and the set of dirty nodes for update_clusters().
+    """
+    rollen_types = list(organisationsrollen_columns.values()) + list(
+        personenrollen_columns.values()
+    )
+    is_rollen = previous_edges["match_type"].isin(rollen_types)
+    touches_affected = previous_edges["source"].isin(affected_ids) | previous_edges[
+        "target"
+    ].isin(affected_ids)
+    kept_edges = previous_edges[~is_rollen & ~touches_affected]
+
+    block_limits = dict(max_pairs=max_pairs, max_block_size=max_block_size, on_oversized=on_oversized)
+    edge_list = [
+        match_organizations_internally_simplified(df_organisationen, only_ids=affected_ids, **block_limits),
+        match_organizations_internally_simplified(
+            df_personen, personen=True, only_ids=affected_ids, **block_limits
+        ),
+        match_organizations_between_dataframes(df_personen, df_organisationen, only_ids=affected_ids),
+    ]
+    edge_list = [edges for edges in edge_list if not edges.empty]
+    if edge_list:
+        new_edges = cleanup_edges_df(pd.concat(edge_list, ignore_index=True))
+    else:
+        new_edges = pd.DataFrame(columns=["source", "target", "match_type", "bidirectional"])
+
+    # Organisationsrollen edges that were added or removed since the last run.
+    rollen_edges = cleanup_edges_df(edges_organisationsrollen.copy())
+    rollen_diff = rollen_edges[["source", "target", "match_type"]].merge(
+        previous_edges.loc[is_rollen, ["source", "target", "match_type"]],
+        how="outer",
+        indicator=True,
+    )
+    rollen_diff = rollen_diff[rollen_diff["_merge"] != "both"]
+
+    dirty_nodes = (
+        set(affected_ids)
+        | set(new_edges["source"])
+        | set(new_edges["target"])
+        | set(rollen_diff["source"])
+        | set(rollen_diff["target"])
+    )
+
+    all_edges = pd.concat([kept_edges, new_edges, rollen_edges], ignore_index=True)
+    return all_edges, dirty_nodes
+
+
+def build_node_table(cluster_df, edges_df, special_nodes, link_map):
+    """
+    One row per node: node, cluster_id, degree (number of distinct neighbours), is_special, link.
+    link_map is a Series ReferenceID -> Objekt_link, Produktgruppe nodes have no link.
+    """
+    node_df = (
+        cluster_df[["cluster_id", "nodes"]]
+        .explode("nodes")
+        .rename(columns={"nodes": "node"})
+        .reset_index(drop=True)
+    )
+
+    # Several match types between the same two nodes are one edge in the graph
+    swap = edges_df["source"].astype(str) > edges_df["target"].astype(str)
+    pairs = pd.DataFrame(
+        {
+            "a": edges_df["source"].where(~swap, edges_df["target"]),
+            "b": edges_df["target"].where(~swap, edges_df["source"]),
+        }
+    ).drop_duplicates()
+    degree = pd.concat([pairs["a"], pairs["b"]]).value_counts()
+
+    node_df["degree"] = node_df["node"].map(degree).fillna(0).astype(int)
+    node_df["is_special"] = node_df["node"].isin(special_nodes)
+    links = node_df["node"].map(link_map)
+    node_df["link"] = links.astype(object).where(links.notna(), None)
+
+    return node_df
+
+
+def build_cluster_summary(cluster_df, node_df, edges_df):
+    """
+    One row per cluster: cluster_size, n_nodes (including special nodes), central_node
+    and a histogram of match types ("Email, Name" counts for both), sorted by cluster_size descending.
+    """
+    node_to_cluster = node_df.set_index("node")["cluster_id"]
+    match_types = pd.DataFrame(
+        {
+            "cluster_id": edges_df["source"].map(node_to_cluster),
+            "match_type": edges_df["match_type"].str.split(", "),
+        }
+    ).explode("match_type", ignore_index=True)
+    histogram = pd.crosstab(match_types["cluster_id"], match_types["match_type"])
+    histogram.columns = [f"edges_{match_type}" for match_type in histogram.columns]
+
+    summary_df = cluster_df[["cluster_id", "cluster_size", "central_node"]].copy()
+    summary_df["n_nodes"] = cluster_df["nodes"].str.len()
+    if "hub_nodes" in cluster_df.columns:
+        summary_df["n_hub_nodes"] = cluster_df["hub_nodes"].str.len()
+    summary_df = summary_df.merge(
+        histogram, left_on="cluster_id", right_index=True, how="left"
+    )
+    summary_df[list(histogram.columns)] = (
+        summary_df[list(histogram.columns)].fillna(0).astype(int)
+    )
+    summary_df.sort_values(
+        ["cluster_size", "cluster_id"], ascending=[False, True], inplace=True
+    )
+    summary_df.reset_index(drop=True, inplace=True)
+
+    return summary_df
+
+
+def create_edges_and_clusters(
+    file_paths,
+    incremental=False,
+    cut_hubs=False,
+    hub_threshold=None,
+    hub_min_degree=100,
+    max_pairs=20_000_000,
+    max_block_size=None,
+    on_oversized="raise",
+):
+    """
+    Main function that calls all those above. Finds ALL clusters that are connected (not just Dubletten), used for visualization.
+    Besides the pickle, a node table and a cluster summary are stored as parquet (see load_cluster_tables())
+    and the graph as flat arrays in graph_export/ (see open_graph_export()).
+    With incremental=True, the previous edges_clusters_dfs.pickle is loaded and only records that were added, changed or deleted
+    since then are processed. Unchanged clusters keep their cluster_id.
+    Optionally with cut_hubs=True (off by default, as it changes cluster membership), hub nodes (see find_hub_nodes(),
+    hub_threshold and hub_min_degree are passed on) do not merge clusters, the cut hubs are reported and stored as "hubs" in the pickle.
+    max_pairs, max_block_size and on_oversized limit the self-merges on Telefon/Email/Name/Adresse
+    (see check_block_sizes()), in full and incremental runs alike.
+    """
     # Assuming pickle file was created by raw_cleanup()
     with open(
         "data/calculated/personen_organisationen_dfs_processed.pickle",
@@ -268,68 +667,160 @@ def create_edges_and_clusters(file_paths):
     df_personen = dfs["personen"]
     df_organisationen = dfs["organisationen"]
 
-    # helper functions to map ReferenceIDs to hyperlinks
-    def create_link_mapping(df):
-        return dict(zip(df["ReferenceID"], df["Objekt_link"]))
-
-    personen_link_map = create_link_mapping(df_personen)
-    organisationen_link_map = create_link_mapping(df_organisationen)
+    # map ReferenceIDs to hyperlinks (Personen first, empty links are ignored)
+    link_map = pd.concat(
+        [
+            df_personen.set_index("ReferenceID")["Objekt_link"],
+            df_organisationen.set_index("ReferenceID")["Objekt_link"],
+        ]
+    )
+    link_map = link_map[link_map.notna() & (link_map != "")]
+    link_map = link_map[~link_map.index.duplicated()]
 
-    def generate_links_for_cluster(node_list):
-        links = []
-        for node in node_list:
-            link = personen_link_map.get(node) or organisationen_link_map.get(node)
-            links.append(link if link is not None else None)
-        return links
+    directory = "data/calculated"
+    output_path = os.path.join(directory, "edges_clusters_dfs.pickle")
 
-    edges_organisationen = match_organizations_internally_simplified(df_organisationen)
+    fingerprints = pd.concat(
+        [record_fingerprints(df_personen), record_fingerprints(df_organisationen)]
+    )
 
     organisationsrollen_df = load_data(file_paths["organisationsrollen"])
-    edges_organisationsrollen = organisationsrollen_group_aggregate(
+    organisationsrollen_aggregate = organisationsrollen_group_aggregate(
         organisationsrollen_df
     )
     edges_organisationsrollen = generate_edge_list_from_orginationsrollen_aggregate(
-        edges_organisationsrollen
+        organisationsrollen_aggregate
     )
 
-    edges_personen = match_organizations_internally_simplified(
-        df_personen, personen=True
+    # Personenrollen (Kontakt-, Technik-, Statistikperson), only edges to known Personen/Organisationen.
+    personenrollen_df = load_data(file_paths["personenrollen"])
+    personenrollen_aggregate = personenrollen_group_aggregate(personenrollen_df)
+    edges_personenrollen = generate_edge_list_from_rollen_aggregate(
+        personenrollen_aggregate,
+        personenrollen_columns,
+        known_ids=set(df_personen["ReferenceID"]) | set(df_organisationen["ReferenceID"]),
     )
-
-    edges_personen_to_organisationen = match_organizations_between_dataframes(
-        df_personen, df_organisationen
+    # Both are handled the same from here on (incremental mode, special nodes).
+    edges_organisationsrollen = pd.concat(
+        [edges_organisationsrollen, edges_personenrollen], ignore_index=True
+    )
+    produktgruppen_labels = pd.concat(
+        [
+            produktgruppen_label_table(organisationsrollen_aggregate),
+            produktgruppen_label_table(personenrollen_aggregate),
+        ],
+        ignore_index=True,
     )
-
-    # TODO: Personenrollen-edges hinzufügen. Im GraphViewer app bereits vorhanden!
-
-    # Summarize and clean up everything.
-    edge_list = []
-    edge_list.append(edges_organisationen)
-    edge_list.append(edges_personen)
-    edge_list.append(edges_organisationsrollen)
-    edge_list.append(edges_personen_to_organisationen)
-    all_edges = pd.concat(edge_list, ignore_index=True)
-
-    all_edges = cleanup_edges_df(all_edges)
 
     special_nodes = set(
         edges_organisationsrollen["source"].unique()
     )  # should not count towards cluster sizes or be central nodes.
 
-    all_clusters = find_clusters_all(
-        all_edges, special_nodes, skip_singular_clusters=False
-    )
+    def get_hubs(edges):
+        if not cut_hubs:
+            return find_hub_nodes(edges.iloc[:0])
+        hubs = find_hub_nodes(edges, threshold=hub_threshold, min_degree=hub_min_degree)
+        if not hubs.empty:
+            print(f"{hubs['node'].nunique()} hub nodes are cut from the clusters:")
+            print(hubs.to_string(index=False))
+        return hubs
+
+    previous = None
+    if incremental:
+        if os.path.exists(output_path):
+            previous = load_data(output_path)
+        if previous is None or "fingerprints" not in previous or "hubs" not in previous:
+            print("No previous run with fingerprints and hubs found, computing all edges and clusters.")
+            previous = None
+
+    if previous is not None:
+        old_fingerprints = previous["fingerprints"]
+        common_ids = fingerprints.index.intersection(old_fingerprints.index)
+        changed_ids = common_ids[
+            fingerprints[common_ids].values != old_fingerprints[common_ids].values
+        ]
+        affected_ids = (
+            set(changed_ids)
+            | set(fingerprints.index.difference(old_fingerprints.index))
+            | set(old_fingerprints.index.difference(fingerprints.index))
+        )
+        print(f"Incremental update: {len(affected_ids)} added, changed or deleted records.")
+
+        all_edges, dirty_nodes = update_edges(
+            previous["edges"],
+            df_personen,
+            df_organisationen,
+            edges_organisationsrollen,
+            affected_ids,
+            max_pairs=max_pairs,
+            max_block_size=max_block_size,
+            on_oversized=on_oversized,
+        )
+        hubs = get_hubs(all_edges)
+        # edges that are cut now but were not before (or vice versa) change the clusters of both nodes
+        changed_cut = hub_edge_mask(all_edges, previous["hubs"])[0] != hub_edge_mask(all_edges, hubs)[0]
+        dirty_nodes |= set(all_edges.loc[changed_cut, "source"]) | set(
+            all_edges.loc[changed_cut, "target"]
+        )
+        all_clusters = update_clusters(
+            previous["clusters"], all_edges, dirty_nodes, special_nodes, hubs=hubs
+        )
+    else:
+        block_limits = dict(max_pairs=max_pairs, max_block_size=max_block_size, on_oversized=on_oversized)
+        edges_organisationen = match_organizations_internally_simplified(df_organisationen, **block_limits)
+
+        edges_personen = match_organizations_internally_simplified(
+            df_personen, personen=True, **block_limits
+        )
+
+        edges_personen_to_organisationen = match_organizations_between_dataframes(
+            df_personen, df_organisationen
+        )
+
+        # Summarize and clean up everything.
+        edge_list = []
+        edge_list.append(edges_organisationen)
+        edge_list.append(edges_personen)
+        edge_list.append(edges_organisationsrollen)
+        edge_list.append(edges_personen_to_organisationen)
+        all_edges = pd.concat(edge_list, ignore_index=True)
+
+        all_edges = cleanup_edges_df(all_edges)
+
+        hubs = get_hubs(all_edges)
+        all_clusters = find_clusters_all(
+            all_edges, special_nodes, skip_singular_clusters=False, hubs=hubs
+        )
+
+    # Flat node table (also used for the link column) and per-cluster summary, for fast lookups in the GraphViewer
+    node_table = build_node_table(all_clusters, all_edges, special_nodes, link_map)
+    node_table["is_hub"] = node_table["node"].isin(hubs["node"])
+    cluster_summary = build_cluster_summary(all_clusters, node_table, all_edges)
 
     # add new link column with list of links corresponding to list of nodes
-    all_clusters["link"] = all_clusters["nodes"].apply(generate_links_for_cluster)
+    all_clusters["link"] = all_clusters["cluster_id"].map(
+        node_table.groupby("cluster_id", sort=False)["link"].agg(list)
+    )
 
     # Store dataframes as pickle
-    dfs = {"edges": all_edges, "clusters": all_clusters}
+    dfs = {
+        "edges": all_edges,
+        "clusters": all_clusters,
+        "fingerprints": fingerprints,
+        "produktgruppen_labels": produktgruppen_labels,
+        "hubs": hubs,
+    }
     # Create the directory if it doesn't exist
-    directory = "data/calculated"
     os.makedirs(directory, exist_ok=True)
-    with open(os.path.join(directory, "edges_clusters_dfs.pickle"), "wb") as file:
+    with open(output_path, "wb") as file:
         pickle.dump(dfs, file)
+    save_cluster_tables(node_table, cluster_summary, directory)
+    export_graph_arrays(
+        node_table,
+        all_edges,
+        produktgruppen_labels,
+        directory=os.path.join(directory, "graph_export"),
+    )
 
     return
 
@@ -343,19 +834,23 @@ def abbreviate_first_name(name):
     return ' '.join(parts)
 
 
-def find_name_adresse_doubletten(df, organisationen=True, abbreviated_first_name=False, only_with_Geschaeftspartner=False):
+def find_name_adresse_doubletten(df, organisationen=True, abbreviated_first_name=False, only_with_Geschaeftspartner=False, name_variant="exact"):
     """
     A cluster here is just any group of organizations with exact match in Name and Adresse (email irrelevant). Used for Doubletten analyses.
+    Groups on the hashed keys from add_name_variant_keys() (computed here if the processed data is older).
+    name_variant: "exact", "normalized" (whitespace collapsed), "abbrev" (same as abbreviated_first_name=True, only for Personen),
+    "swapped" or "folded".
+    cluster_ids are numbered 0, 1, ... in the order of name and address, like the former groupby on the strings.
     """
-    # Group by 'Name' and 'address_full', and assign cluster_id
-    if organisationen:
-        df['cluster_id'] = df.groupby(['Name_Zeile2', 'address_full']).ngroup()
-    else:
-        if abbreviated_first_name:
-            df["Name_abbrev"] = df["Name"].apply(abbreviate_first_name)
-            df['cluster_id'] = df.groupby(['Name_abbrev', 'address_full']).ngroup()
-        else:
-            df['cluster_id'] = df.groupby(['Name', 'address_full']).ngroup()
+    if abbreviated_first_name and not organisationen:
+        name_variant = "abbrev"
+    name_key = "name_key" if name_variant == "exact" else f"name_key_{name_variant}"
+    name_column = "Name_Zeile2" if organisationen else "Name"
+    if name_key not in df.columns or "address_key" not in df.columns:
+        df = add_name_variant_keys(df, name_column=name_column)
+
+    # Group by name and address keys, and assign cluster_id
+    df['cluster_id'] = df.groupby([name_key, 'address_key']).ngroup()
 
     # Keep only groups with at least 2 identical rows
     df = df[df.groupby('cluster_id')['cluster_id'].transform('size') > 1]
@@ -364,10 +859,157 @@ def find_name_adresse_doubletten(df, organisationen=True, abbreviated_first_name
     if only_with_Geschaeftspartner:
         df = df[df.groupby('cluster_id')['Geschaeftspartner_list'].transform(lambda x: x.str.len().max() > 0)]
 
+    # ngroup() numbers the groups in hash order, renumber them in order of first appearance by name and address
+    in_name_order = df.sort_values([name_column, 'address_full'], kind='stable')['cluster_id']
+    new_ids = pd.Series(pd.factorize(in_name_order)[0], index=in_name_order.index)
+    df = df.assign(cluster_id=new_ids)
+
     if organisationen:
         df.sort_values(by='Name_Zeile2', inplace=True)
     else:
         df.sort_values(by='Name', inplace=True)
     df.reset_index(drop=True, inplace=True)
 
-    return df
\ No newline at end of file
+    return df
+
+
+def normalize_for_fuzzy_matching(series, addresses=False):
+    """
+    Lowercase, fold umlauts and diacritics (see fold_diacritics()), remove punctuation and sort the words,
+    so that word-order changes don't lower the similarity score.
+    With addresses=True, street abbreviations are written out first ("Hauptstr. 5" / "Haupt-Str.5" / "Haupt Strasse 5" -> "hauptstrasse 5").
+    """
+    normalized = fold_diacritics(series.fillna("").astype(str))
+    if addresses:
+        normalized = normalized.str.replace(r"[\s-]*(strasse|str)\b\.?", "strasse ", regex=True)
+    normalized = normalized.str.replace(r"[^a-z0-9\s]", " ", regex=True)
+    return normalized.str.split().map(lambda tokens: " ".join(sorted(tokens)))
+
+
+def score_candidate_pairs(batch, name_threshold=0.9, address_threshold=0.85):
+    """
+    Worker function for find_fuzzy_name_adresse_doubletten(), scores one batch of candidate pairs.
+    batch is a tuple (row_x, row_y, names_x, names_y, addresses_x, addresses_y), returns the accepted (row_x, row_y).
+    quick_ratio() is an upper bound of ratio(), so most pairs are discarded before the expensive comparison.
+    """
+    rows_x, rows_y, names_x, names_y, addresses_x, addresses_y = batch
+    accepted = []
+    for row_x, row_y, name_x, name_y, address_x, address_y in zip(
+        rows_x, rows_y, names_x, names_y, addresses_x, addresses_y
+    ):
+        name_matcher = SequenceMatcher(None, name_x, name_y)
+        if name_matcher.quick_ratio() < name_threshold:
+            continue
+        address_matcher = SequenceMatcher(None, address_x, address_y)
+        if address_matcher.quick_ratio() < address_threshold:
+            continue
+        if (
+            name_matcher.ratio() >= name_threshold
+            and address_matcher.ratio() >= address_threshold
+        ):
+            accepted.append((row_x, row_y))
+    return accepted
+
+
+def find_fuzzy_name_adresse_doubletten(
+    df,
+    organisationen=True,
+    name_threshold=0.9,
+    address_threshold=0.85,
+    max_block_size=500,
+    on_oversized="cap",
+    batch_size=20000,
+    num_processes=None,
+    only_with_Geschaeftspartner=False,
+):
+    """
+    Fuzzy version of find_name_adresse_doubletten(), also finds typos, "Str."/"Strasse" variants and word-order changes.
+    - Blocking: only records with the same PLZ and the same numbers in the address (house number, PO box)
+      whose names share the first 3 characters of a word (words >= 3 characters, so "mustr" / "muster" still meet)
+      are compared. Blocks larger than max_block_size (e.g. very common words) are reported and skipped,
+      or raise a ValueError with on_oversized="raise" (see check_block_sizes()).
+    - Scoring: difflib similarity of the normalized name and address, batches are scored on a process pool.
+      Pairs whose length difference alone rules out the thresholds are dropped before scoring.
+    - Grouping: all pairs above both thresholds are connected, each connected component becomes one cluster_id.
+    Output has the same format as find_name_adresse_doubletten(), so all downstream filters can be used.
+    """
+    name_column = "Name_Zeile2" if organisationen else "Name"
+    df = df.reset_index(drop=True)
+
+    names = normalize_for_fuzzy_matching(df[name_column])
+    addresses = normalize_for_fuzzy_matching(df["address_full"], addresses=True)
+    plz = (
+        df["ZipPostalCode"].fillna("").astype(str).str.replace(r"\.0$", "", regex=True)
+        if "ZipPostalCode" in df.columns
+        else df["address_full"].fillna("").str.extract(r"\b(\d{4,5})\b")[0].fillna("")
+    )
+
+    numbers = addresses.str.findall(r"\d+").str.join(" ")
+
+    # Blocking key: PLZ | address numbers | name word prefix
+    keys = pd.DataFrame({"row": np.arange(len(df)), "word": names.str.split()})
+    keys["block"] = plz.to_numpy() + "|" + numbers.to_numpy() + "|"
+    keys = keys.explode("word").dropna(subset=["word"])
+    keys = keys[keys["word"].str.len() >= 3]
+    keys = pd.DataFrame({"row": keys["row"], "block": keys["block"] + keys["word"].str[:3]}).drop_duplicates()
+    keys, _ = check_block_sizes(
+        keys, "block", max_pairs=None, max_block_size=max_block_size, on_oversized=on_oversized
+    )
+
+    # Candidate pairs within blocks
+    pairs = keys.merge(keys, on="block")
+    pairs = pairs.loc[pairs["row_x"] < pairs["row_y"], ["row_x", "row_y"]].drop_duplicates()
+    rows_x = pairs["row_x"].to_numpy()
+    rows_y = pairs["row_y"].to_numpy()
+    names_array = names.to_numpy()
+    addresses_array = addresses.to_numpy()
+
+    # difflib ratio is at most 2 * shorter / (len_a + len_b)
+    for lengths, threshold in [
+        (names.str.len().to_numpy(), name_threshold),
+        (addresses.str.len().to_numpy(), address_threshold),
+    ]:
+        length_x, length_y = lengths[rows_x], lengths[rows_y]
+        upper_bound = 2 * np.minimum(length_x, length_y) / np.maximum(length_x + length_y, 1)
+        rows_x, rows_y = rows_x[upper_bound >= threshold], rows_y[upper_bound >= threshold]
+
+    batches = [
+        (
+            rows_x[i : i + batch_size],
+            rows_y[i : i + batch_size],
+            names_array[rows_x[i : i + batch_size]],
+            names_array[rows_y[i : i + batch_size]],
+            addresses_array[rows_x[i : i + batch_size]],
+            addresses_array[rows_y[i : i + batch_size]],
+        )
+        for i in range(0, len(rows_x), batch_size)
+    ]
+    score_func = partial(
+        score_candidate_pairs,
+        name_threshold=name_threshold,
+        address_threshold=address_threshold,
+    )
+    if len(batches) > 1 and num_processes != 1:
+        with multiprocessing.Pool(processes=num_processes) as pool:
+            accepted_batches = pool.map(score_func, batches)
+    else:
+        accepted_batches = [score_func(batch) for batch in batches]
+
+    # Connected components of accepted pairs become clusters
+    G = nx.Graph()
+    G.add_edges_from(pair for batch in accepted_batches for pair in batch)
+    cluster_ids = np.full(len(df), -1)
+    components = sorted(nx.connected_components(G), key=min)
+    for i, component in enumerate(components):
+        cluster_ids[list(component)] = i
+
+    df["cluster_id"] = cluster_ids
+    df = df[df["cluster_id"] >= 0]
+
+    if only_with_Geschaeftspartner:
+        df = df[df.groupby('cluster_id')['Geschaeftspartner_list'].transform(lambda x: x.str.len().max() > 0)]
+
+    df = df.sort_values(by=name_column)
+    df.reset_index(drop=True, inplace=True)
+
+    return df
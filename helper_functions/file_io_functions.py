@@ -1,5 +1,7 @@
 import os
 import glob
+import json
+import numpy as np
 import pandas as pd
 import pickle
 
@@ -102,6 +104,144 @@ def save_results(data, filename):
         pickle.dump(data, file)
 
 
+def save_cluster_tables(node_df, summary_df, directory="data/calculated"):
+    """
+    Stores node table and cluster summary from create_edges_and_clusters() in a columnar format (parquet).
+    Nodes are stored as strings, because Produktgruppe nodes are integers and ReferenceIDs are strings.
+    """
+    os.makedirs(directory, exist_ok=True)
+    node_df = node_df.assign(node=node_df["node"].astype(str))
+    summary_df = summary_df.assign(central_node=summary_df["central_node"].astype(str))
+    node_df.to_parquet(os.path.join(directory, "cluster_nodes.parquet"), index=False)
+    summary_df.to_parquet(os.path.join(directory, "cluster_summary.parquet"), index=False)
+
+
+def load_cluster_tables(directory="data/calculated"):
+    """
+    Returns node table indexed by node and cluster summary indexed by cluster_id (sorted by cluster_size descending).
+    "Which cluster is X in": node_df.loc[X, "cluster_id"], "the 100 largest clusters": summary_df.head(100).
+    """
+    node_df = pd.read_parquet(os.path.join(directory, "cluster_nodes.parquet"))
+    summary_df = pd.read_parquet(os.path.join(directory, "cluster_summary.parquet"))
+    return node_df.set_index("node"), summary_df.set_index("cluster_id")
+
+
+def write_string_table(strings, directory, name):
+    # Strings as one UTF-8 byte array plus offsets, so they can be memory-mapped. String i is data[offsets[i]:offsets[i+1]].
+    encoded = [str(string).encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    np.save(os.path.join(directory, f"{name}_offsets.npy"), offsets)
+    np.save(os.path.join(directory, f"{name}_data.npy"), data)
+
+
+def read_strings(export, name, start, end):
+    # Counterpart of write_string_table(), reads strings start..end-1.
+    offsets = export[f"{name}_offsets"]
+    data = export[f"{name}_data"]
+    return [
+        bytes(data[offsets[i] : offsets[i + 1]]).decode("utf-8")
+        for i in range(start, end)
+    ]
+
+
+def export_graph_arrays(node_df, edges_df, labels_df, directory="data/calculated/graph_export"):
+    """
+    Exports the graph from create_edges_and_clusters() as flat numpy arrays (.npy) that can be memory-mapped,
+    so the GraphViewer does not have to unpickle DataFrames with list columns:
+    - nodes are ordered by cluster, cluster_offsets[k]:cluster_offsets[k+1] are the nodes of cluster cluster_ids[k]
+    - adjacency in CSR format: neighbours of node i are indices[indptr[i]:indptr[i+1]], with match_type_codes alongside
+    - is_special per node, string tables for node ids (as in cluster_nodes.parquet and the edges, to join back),
+      node labels (for display, Produktgruppen get their readable label) and links
+    - meta.json with the names of the match type codes
+    node_df is the node table from build_node_table(), labels_df the produktgruppen_labels (node, label).
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    node_df = node_df.sort_values("cluster_id", kind="stable").reset_index(drop=True)
+    node_positions = pd.Series(np.arange(len(node_df)), index=node_df["node"].values)
+    cluster_ids, cluster_starts = np.unique(node_df["cluster_id"], return_index=True)
+    cluster_offsets = np.append(cluster_starts, len(node_df)).astype(np.int64)
+
+    match_type_codes, match_type_names = pd.factorize(edges_df["match_type"])
+    sources = edges_df["source"].map(node_positions).to_numpy()
+    targets = edges_df["target"].map(node_positions).to_numpy()
+    valid = ~(pd.isna(sources) | pd.isna(targets))
+    sources = sources[valid].astype(np.int64)
+    targets = targets[valid].astype(np.int64)
+    match_type_codes = match_type_codes[valid]
+
+    # Undirected graph: store every edge in both directions
+    rows = np.concatenate([sources, targets])
+    columns = np.concatenate([targets, sources])
+    codes = np.concatenate([match_type_codes, match_type_codes]).astype(np.int16)
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(len(node_df) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(node_df)), out=indptr[1:])
+
+    arrays = {
+        "cluster_ids": cluster_ids.astype(np.int64),
+        "cluster_offsets": cluster_offsets,
+        "indptr": indptr,
+        "indices": columns[order],
+        "match_type_codes": codes[order],
+        "is_special": node_df["is_special"].to_numpy(dtype=bool),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    label_map = labels_df.set_index("node")["label"]
+    node_labels = node_df["node"].map(label_map).fillna(node_df["node"].astype(str))
+    write_string_table(node_df["node"].astype(str), directory, "node_ids")
+    write_string_table(node_labels, directory, "node_labels")
+    write_string_table(node_df["link"].fillna(""), directory, "links")
+
+    with open(os.path.join(directory, "meta.json"), "w") as file:
+        json.dump({"match_types": list(match_type_names)}, file)
+
+
+def open_graph_export(directory="data/calculated/graph_export"):
+    # Opens all arrays of export_graph_arrays() memory-mapped (nothing is read until it is sliced).
+    export = {}
+    for file_name in os.listdir(directory):
+        if file_name.endswith(".npy"):
+            export[file_name[:-4]] = np.load(os.path.join(directory, file_name), mmap_mode="r")
+    with open(os.path.join(directory, "meta.json")) as file:
+        export["match_types"] = json.load(file)["match_types"]
+    return export
+
+
+def read_cluster_subgraph(export, cluster_id):
+    """
+    Reads the subgraph of one cluster from open_graph_export() by slicing.
+    Returns a dict with nodes (ids as strings, same as in cluster_nodes.parquet), labels (for display), links, is_special,
+    and the edges as local node positions (source, target) with match_type.
+    """
+    position = np.searchsorted(export["cluster_ids"], cluster_id)
+    if position >= len(export["cluster_ids"]) or export["cluster_ids"][position] != cluster_id:
+        raise ValueError(f"cluster_id {cluster_id} not found in graph export")
+    start = int(export["cluster_offsets"][position])
+    end = int(export["cluster_offsets"][position + 1])
+
+    indptr = np.asarray(export["indptr"][start : end + 1])
+    local_source = np.repeat(np.arange(end - start), np.diff(indptr))
+    local_target = np.asarray(export["indices"][indptr[0] : indptr[-1]]) - start
+    codes = np.asarray(export["match_type_codes"][indptr[0] : indptr[-1]])
+    # every edge is stored in both directions, edges to cut hubs in other clusters are skipped
+    once = (local_source < local_target) & (local_target < end - start)
+
+    return {
+        "nodes": read_strings(export, "node_ids", start, end),
+        "labels": read_strings(export, "node_labels", start, end),
+        "links": read_strings(export, "links", start, end),
+        "is_special": np.asarray(export["is_special"][start:end]),
+        "source": local_source[once],
+        "target": local_target[once],
+        "match_type": [export["match_types"][code] for code in codes[once]],
+    }
+
+
 def create_excel_files_from_nested_dict(nested_dict, output_dir="output"):
     """
     For output of Organisationsrollenanalyse:
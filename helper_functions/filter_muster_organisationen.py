@@ -1,31 +1,96 @@
+import time
+import operator
 import pandas as pd
-import multiprocessing
-from functools import partial
+import numpy as np
+from itertools import chain
+import string
 
 from helper_functions.analyses_formatting import set_master_flag
 from .hardcoded_values import produkte_dict_name_first
+from .cleanup_functions import add_name_variant_keys, hash_key
+from .parallel_processing import execute_tasks
+
+
+comparison_operators = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def row_mask(df, column, op, value):
+    """
+    Boolean mask for one row predicate (column, op, value), see apply_filter_spec().
+    op is a comparison ("==", ">", ...), "isin", "len" + comparison ("len==", "len>", ...) for list columns,
+    or "single_in" (list with exactly one element, which is in value).
+    """
+    if op in comparison_operators:
+        return comparison_operators[op](df[column], value)
+    if op == "isin":
+        return df[column].isin(value)
+    if op.startswith("len") and op[3:] in comparison_operators:
+        return comparison_operators[op[3:]](df[column].str.len(), value)
+    if op == "single_in":
+        lengths = df[column].str.len()
+        first = df[column].str[0].where(lengths == 1)
+        return (lengths == 1) & first.isin(value)
+    raise ValueError(f"Unknown filter operator '{op}'")
+
+
+def apply_filter_spec(df, spec):
+    """
+    Filters df by a declarative spec (dict), all conditions are combined with AND:
+    - "rows": list of row predicates (column, op, value), see row_mask()
+    - "groups": list of group predicates (agg, column, op, value) evaluated on the remaining rows of each group,
+      agg is "any", "all" or ("count", op, n), e.g. ("count", ">=", 2) = at least 2 members match
+    - "min_group_size": groups with fewer remaining members are removed (default 2)
+    - "group_column": default "cluster_id", rows without a group are removed
+    Example: {"rows": [("Servicerole_count", "==", 0)], "groups": [("any", "Geschaeftspartner_list", "len>", 0)]}
+    """
+    group_column = spec.get("group_column", "cluster_id")
+
+    # Filters on the individual level
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in spec.get("rows", []):
+        mask &= row_mask(df, column, op, value)
+    df = df[mask & df[group_column].notna()]
+
+    # Filters on the group level
+    groups = df.groupby(group_column)
+    mask = groups[group_column].transform("size") >= spec.get("min_group_size", 2)
+    for agg, column, op, value in spec.get("groups", []):
+        matches = row_mask(df, column, op, value).groupby(df[group_column])
+        if agg in ("any", "all"):
+            mask &= matches.transform(agg).astype(bool)
+        else:
+            _, count_op, n = agg
+            mask &= comparison_operators[count_op](matches.transform("sum"), n)
+
+    return df[mask]
 
 
 def general_exclusion_criteria(
     df, no_Produkte=True, no_Geschaeftspartner=True, no_Servicerole=True, only_with_Geschaeftspartner=False
 ):
-    # Apply conditions to each row
+    # Preset of apply_filter_spec()
+    rows = []
     if no_Produkte:
-        df = df[((df["Produkt_Inhaber"] == 0) & (df["Produkt_Adressant"] == 0))]
+        rows += [("Produkt_Inhaber", "==", 0), ("Produkt_Adressant", "==", 0)]
     if no_Geschaeftspartner:
-        df = df[~df["Geschaeftspartner_list"].apply(lambda gp: len(gp) != 0)]
+        rows.append(("Geschaeftspartner_list", "len==", 0))
     if no_Servicerole:
-        df = df[df["Servicerole_count"] == 0]
-        
-    # Filters on the group level
+        rows.append(("Servicerole_count", "==", 0))
+
     # At least one member of a cluster must have a Geschaeftspartner connection
+    groups = []
     if only_with_Geschaeftspartner:
-        df = df.groupby("cluster_id").filter(
-            lambda x: x["Geschaeftspartner_list"].apply(lambda gp: len(gp) > 0).any()
-        )
+        groups.append(("any", "Geschaeftspartner_list", "len>", 0))
 
     # Filter out groups with less than 2 members
-    return df[df.groupby("cluster_id")["cluster_id"].transform("size") >= 2]
+    return apply_filter_spec(df, {"rows": rows, "groups": groups, "min_group_size": 2})
 
 
 def general_exclusion_criteria_personen(
@@ -40,47 +105,38 @@ def general_exclusion_criteria_personen(
     """
     Removes entries that don't match a certain criterion. If this results in a group of Doubletten having only one member, the whole group is removed.
     Note we currently look at Personen that ONLY have a single Verknüpfung to one organisation. In future cleanup may want to relax that, though only 15 cases in doubletten (300 total).
+    Preset of apply_filter_spec().
     """
-    # Filters on the individual level
+    rows = []
     if no_Produkte:
-        df = df[df["Produkt_rolle"].apply(lambda x: len(x) == 0)]
+        rows.append(("Produkt_rolle", "len==", 0))
     if no_Geschaeftspartner:
-        df = df[df["Geschaeftspartner_list"].apply(lambda gp: len(gp) == 0)]
+        rows.append(("Geschaeftspartner_list", "len==", 0))
     if no_Servicerole:
-        df = df[df["Servicerole_string"] == ""]
+        rows.append(("Servicerole_string", "==", ""))
 
     if only_physisch:
-        df = df[df["Versandart"] == "Physisch"]
+        rows.append(("Versandart", "==", "Physisch"))
     else:
         # Is there anything other than pysisch or portal, and do we want to include this at some point?
-        df = df[(df["Versandart"] == "Physisch") | (df["Versandart"] == "Portal")]
+        rows.append(("Versandart", "isin", ["Physisch", "Portal"]))
 
     if only_mitarbeiter:
-        df = df[
-            df["Verknuepfungsart_list"].apply(
-                lambda x: len(x) == 1 and x[0] == "Mitarbeiter"
-            )
-        ]
+        rows.append(("Verknuepfungsart_list", "single_in", ["Mitarbeiter"]))
     else:
         # Alternative: Can have one Mitarbeiter or one Administrator connection
         # the no_geschaeftspartner parameter just allows Geschaeftspartner optionally, this one enforces them.
-        df = df[
-            df["Verknuepfungsart_list"].apply(
-                lambda x: len(x) == 1
-                and (x[0] == "Mitarbeiter" or x[0] == "Administrator")
-            )
-        ]
-    # Filters on the group level
+        rows.append(
+            ("Verknuepfungsart_list", "single_in", ["Mitarbeiter", "Administrator"])
+        )
+
     # At least one member of a cluster must have a Geschaeftspartner connection
+    groups = []
     if only_with_Geschaeftspartner:
-        df = df.groupby("cluster_id").filter(
-            lambda x: x["Geschaeftspartner_list"].apply(lambda gp: len(gp) > 0).any()
-        )
+        groups.append(("any", "Geschaeftspartner_list", "len>", 0))
 
     # Remove groups with only one member left after filtering
-    df = df.groupby("cluster_id").filter(lambda x: len(x) > 1)
-
-    return df
+    return apply_filter_spec(df, {"rows": rows, "groups": groups, "min_group_size": 2})
 
 
 def filter_clusters_with_mixed_produkt_roles(
@@ -93,54 +149,47 @@ def filter_clusters_with_mixed_produkt_roles(
     """
     # Apply initial filters to remove entries based on no_Geschaeftspartner and no_Servicerole
     if no_Geschaeftspartner:
-        df = df[~df["Geschaeftspartner_list"].apply(lambda gp: len(gp) != 0)]
+        df = df[row_mask(df, "Geschaeftspartner_list", "len==", 0)]
     if no_Servicerole:
         df = df[df["Servicerole_count"] == 0]
 
-    def filter_relevant_members(group):
-        # Identify members with both roles > 0
-        has_both_roles = group[
-            (group["Produkt_Inhaber"] > 0) & (group["Produkt_Adressant"] > 0)
-        ]
-        # Identify members with both roles == 0
-        has_zero_roles = group[
-            (group["Produkt_Inhaber"] == 0) & (group["Produkt_Adressant"] == 0)
-        ]
-        # Return relevant members if criteria are met
-        if len(has_both_roles) == 1 and len(has_zero_roles) >= 1:
-            return pd.concat([has_both_roles, has_zero_roles])
-        return pd.DataFrame()
-
-    # Apply the group filter and ensure each group has at least two members
-    filtered_df = df.groupby("cluster_id").apply(filter_relevant_members).reset_index(drop=True)
-    filtered_df = filtered_df[filtered_df.groupby("cluster_id")["cluster_id"].transform("size") >= 2]
+    # Members with both roles > 0 and members with both roles == 0, counted per cluster
+    has_both_roles = (df["Produkt_Inhaber"] > 0) & (df["Produkt_Adressant"] > 0)
+    has_zero_roles = (df["Produkt_Inhaber"] == 0) & (df["Produkt_Adressant"] == 0)
+    n_both_roles = has_both_roles.groupby(df["cluster_id"]).transform("sum")
+    n_zero_roles = has_zero_roles.groupby(df["cluster_id"]).transform("sum")
+
+    # Relevant members if criteria are met: the one with both roles first, then those with zero roles
+    relevant = (n_both_roles == 1) & (n_zero_roles >= 1) & (has_both_roles | has_zero_roles)
+    filtered_df = (
+        df[relevant]
+        .assign(sort_key=has_zero_roles[relevant])
+        .sort_values(["cluster_id", "sort_key"], kind="stable")
+        .drop(columns="sort_key")
+        .reset_index(drop=True)
+    )
 
     return filtered_df
 
 
-
-
 def FDA_servicerole(df):
     """
     Alle Doubletten haben selbe Versandart.
     Genau eine der Doubletten hat Servicerolle "FDA".
     Alle anderen Doubletten haben keine Servicerolle.
     """
-
-    def filter_groups(group):
-        fda_count = (group["Servicerole_string"] == "FDA").sum()
-        empty_count = (group["Servicerole_string"] == "").sum()
-        same_versandart = group["Versandart"].nunique() == 1
-
-        return (fda_count == 1) and (empty_count == len(group) - 1) and same_versandart
-
-    groups = [group for _, group in df.groupby("cluster_id") if filter_groups(group)]
-
-    if not groups:
+    clusters = df.groupby("cluster_id")
+    fda_count = (df["Servicerole_string"] == "FDA").groupby(df["cluster_id"]).transform("sum")
+    empty_count = (df["Servicerole_string"] == "").groupby(df["cluster_id"]).transform("sum")
+    size = clusters["cluster_id"].transform("size")
+    same_versandart = clusters["Versandart"].transform("nunique") == 1
+
+    valid = (fda_count == 1) & (empty_count == size - 1) & same_versandart
+    if not valid.any():
         print("Warning: No groups meet the criteria.")
         return pd.DataFrame()
 
-    return pd.concat(groups)
+    return df[valid].sort_values("cluster_id", kind="stable")
 
 
 def add_singular_produkte_columns_group(group, organisationsrollen_df, produkt):
@@ -196,223 +245,213 @@ def add_singular_produkte_columns_group(group, organisationsrollen_df, produkt):
     return group
 
 
-def add_singular_produkte_columns_group_simplified(
-    group, filtered_organisationsrollen_df
-):
-    # if organisationsrollen_df is already pre-filtered
+produkt_role_columns = {
+    "Inhaber_RefID": ("Inhaber_Objekt", "Inhaber_ProduktID"),
+    "Rechnungsempfaenger_RefID": ("Rechempf_Objekt", "Rechempf_ProduktID"),
+    "Korrespondenzempfaenger_RefID": ("Korrempf_Objekt", "Korrempf_ProduktID"),
+}
 
-    roles = [
-        "Inhaber_RefID",
-        "Rechnungsempfaenger_RefID",
-        "Korrespondenzempfaenger_RefID",
-    ]
-    role_columns = {
-        "Inhaber_RefID": ("Inhaber_Objekt", "Inhaber_ProduktID"),
-        "Rechnungsempfaenger_RefID": ("Rechempf_Objekt", "Rechempf_ProduktID"),
-        "Korrespondenzempfaenger_RefID": ("Korrempf_Objekt", "Korrempf_ProduktID"),
-    }
 
-    # Initialize new columns if they don't exist
-    for column in role_columns.values():
-        for col in column:
-            if col not in group.columns:
-                group[col] = [[] for _ in range(len(group))]
+def build_product_role_index(organisationsrollen_df, full_ids=None):
+    """
+    Long table of all product roles: one row per (RefID, role, FullID, ProduktObj, Produkt_RefID),
+    in the order of organisationsrollen_df within each role. Optionally restricted to some FullIDs.
+    """
+    if full_ids is not None:
+        organisationsrollen_df = organisationsrollen_df[
+            organisationsrollen_df["FullID"].isin(full_ids)
+        ]
+    role_index = organisationsrollen_df.melt(
+        id_vars=["FullID", "ProduktObj", "Produkt_RefID"],
+        value_vars=list(produkt_role_columns),
+        var_name="role",
+        value_name="RefID",
+    )
+    return role_index[role_index["RefID"].notna()]
 
-    # Iterate over each row in the group
-    for index, row in group.iterrows():
-        ref_id = row["ReferenceID"]
 
-        # Filter rows in filtered_organisationsrollen_df based on ref_id and roles
-        filtered_df = filtered_organisationsrollen_df[
-            filtered_organisationsrollen_df[roles].apply(
-                lambda x: ref_id in x.values, axis=1
-            )
-        ]
+def add_product_role_columns(df, role_index, by_product=False):
+    """
+    Hash join of the members in df (ReferenceID) with build_product_role_index(),
+    fills the *_Objekt / *_ProduktID list columns per member (empty lists if the member has no such role).
+    With by_product=True, df has a FullID column and only the roles of that product are joined.
+    """
+    df = df.copy()
+    keys = ["FullID", "RefID"] if by_product else ["RefID"]
+    joined = role_index[role_index["RefID"].isin(df["ReferenceID"])]
+    lists = joined.groupby(["role"] + keys, sort=False).agg(
+        Objekt=("ProduktObj", list), ProduktID=("Produkt_RefID", list)
+    )
+    if by_product:
+        lookup = pd.MultiIndex.from_arrays([df["FullID"], df["ReferenceID"]])
+    else:
+        lookup = pd.Index(df["ReferenceID"])
+    found_roles = set(lists.index.get_level_values("role"))
 
-        for role in roles:
-            # Filter for the specific role
-            role_filtered_df = filtered_df[filtered_df[role] == ref_id]
+    for role, (objekt_col, produktid_col) in produkt_role_columns.items():
+        for col, values in ((objekt_col, "Objekt"), (produktid_col, "ProduktID")):
+            if role in found_roles:
+                found = lists.xs(role, level="role")[values].reindex(lookup)
+            else:
+                found = [None] * len(df)
+            existing = df[col] if col in df.columns else [[] for _ in range(len(df))]
+            df[col] = [
+                list(new) if isinstance(new, list) else old
+                for new, old in zip(found, existing)
+            ]
 
-            # Update the group DataFrame
-            if not role_filtered_df.empty:
-                objekt_col, produktid_col = role_columns[role]
-                group.at[index, objekt_col] = role_filtered_df["ProduktObj"].tolist()
-                group.at[index, produktid_col] = role_filtered_df[
-                    "Produkt_RefID"
-                ].tolist()
+    return df
 
-    return group
 
+def add_singular_produkte_columns_group_simplified(
+    group, filtered_organisationsrollen_df
+):
+    # if organisationsrollen_df is already pre-filtered
+    return add_product_role_columns(
+        group, build_product_role_index(filtered_organisationsrollen_df)
+    )
 
-def cleanup_produkte_columns(df):
+
+def produkte_long_table(df, group_columns="cluster_id", role_columns=("Inhaber_Objekt", "Rechempf_Objekt", "Korrempf_Objekt")):
+    """
+    Long format of the list columns: one row per (group, row, item, role).
+    group is the group number of group_columns (-1 for missing keys), row the position of the row in df.
+    Returns the group number of every row of df and the long table.
+    """
+    group_ids = df.groupby(group_columns, sort=False).ngroup().to_numpy()
+    positions = np.arange(len(df))
+    parts = []
+    for role in role_columns:
+        lengths = df[role].str.len().to_numpy()
+        parts.append(
+            pd.DataFrame(
+                {
+                    "group": np.repeat(group_ids, lengths),
+                    "row": np.repeat(positions, lengths),
+                    "item": list(chain.from_iterable(df[role])),
+                    "role": role,
+                }
+            )
+        )
+    return group_ids, pd.concat(parts, ignore_index=True)
+
+
+def cleanup_produkte_columns(df, group_columns="cluster_id"):
     """
     To be executed after add_singular_produkte_columns_group()
     input df still has groups with empty lists in Inhaber_Objekt etc., which will be removed here.
     Also if any group member has e.g. a produkt listed as Inhaber, but that produkt is nowhere listed as korrempf/rechempf in the group, discards the whole group.
     It does not however care how the products are distributed (e.g. all roles for one org, or distributed across 3)
+    group_columns: e.g. ["FullID", "cluster_id"] to check several products at once.
     """
+    group_ids, long_df = produkte_long_table(df, group_columns)
 
-    def check_group(group):
-        # Check if Inhaber_Objekt and Korrempf_Objekt columns are empty in the entire group
-        if (
-            group["Inhaber_Objekt"].apply(len).sum() == 0
-            and group["Korrempf_Objekt"].apply(len).sum() == 0
-        ):
-            return False  # Mark group for removal
-
-        # Flatten the lists in each column and count occurrences
-        all_inhaber = [item for sublist in group["Inhaber_Objekt"] for item in sublist]
-        all_korrempf = [
-            item for sublist in group["Korrempf_Objekt"] for item in sublist
-        ]
-
-        all_rechempf = [
-            item for sublist in group["Rechempf_Objekt"] for item in sublist
-        ]
-        unique_items = set(all_inhaber + all_rechempf + all_korrempf)
+    # Groups where Inhaber_Objekt and Korrempf_Objekt are empty are removed
+    has_items = long_df.loc[
+        long_df["role"].isin(["Inhaber_Objekt", "Korrempf_Objekt"]), "group"
+    ].unique()
 
-        # Check if each item appears in the required columns
-        for item in unique_items:
-            if all_inhaber.count(item) != 1 or all_korrempf.count(item) != 1:
-                return False  # Mark group for removal
-
-            if all_rechempf.count(item) != 1:
-                return False  # Mark group for removal if Rechempf_Objekt is considered
-
-        return True  # Keep the group
+    # Each item must appear exactly once as Inhaber, Korrempf and Rechempf in the group
+    counts = long_df.groupby(["group", "item", "role"], dropna=False).size()
+    counts = counts.unstack("role", fill_value=0).reindex(
+        columns=["Inhaber_Objekt", "Rechempf_Objekt", "Korrempf_Objekt"], fill_value=0
+    )
+    item_ok = (counts == 1).all(axis=1)
+    bad_groups = item_ok[~item_ok].index.get_level_values("group").unique()
 
-    # Apply the check to each group and filter the DataFrame
-    filtered_df = df.groupby("cluster_id").filter(check_group)
+    valid = (group_ids >= 0) & np.isin(group_ids, has_items) & ~np.isin(group_ids, bad_groups)
+    filtered_df = df[valid]
 
     return filtered_df
 
 
-def cleanup_produkte_columns_only_2_roles(df):
+def cleanup_produkte_columns_only_2_roles(df, group_columns="cluster_id"):
     """
     Modified to filter out groups where an element appears in exactly two of the three roles.
     Groups where all three roles are empty lists or where an element only appears under one role or in all three roles are removed.
+    group_columns: see cleanup_produkte_columns().
     """
+    group_ids, long_df = produkte_long_table(df, group_columns)
 
-    def check_group(group):
-        # Check if all three columns are empty lists in the entire group
-        if (
-            all(group["Inhaber_Objekt"].apply(len) == 0)
-            and all(group["Korrempf_Objekt"].apply(len) == 0)
-            and all(group["Rechempf_Objekt"].apply(len) == 0)
-        ):
-            return False  # Mark group for removal
-
-        # Flatten the lists in each column
-        all_inhaber = [item for sublist in group["Inhaber_Objekt"] for item in sublist]
-        all_korrempf = [
-            item for sublist in group["Korrempf_Objekt"] for item in sublist
-        ]
-        all_rechempf = [
-            item for sublist in group["Rechempf_Objekt"] for item in sublist
-        ]
-
-        unique_items = set(all_inhaber + all_rechempf + all_korrempf)
-
-        # Check if each item appears in exactly two of the three roles
-        for item in unique_items:
-            count = 0
-            if item in all_inhaber:
-                count += 1
-            if item in all_korrempf:
-                count += 1
-            if item in all_rechempf:
-                count += 1
+    # Groups where all three columns are empty are removed
+    has_items = long_df["group"].unique()
 
-            if count != 2:  # Remove group if item is in 1 or 3 roles
-                return False
+    # Each item must appear in exactly two of the three roles (how often does not matter)
+    n_roles = long_df.groupby(["group", "item"], dropna=False)["role"].nunique()
+    bad_groups = n_roles[n_roles != 2].index.get_level_values("group").unique()
 
-        return True  # Keep the group if all items are in exactly two roles
-
-    # Apply the check to each group and filter the DataFrame
-    filtered_df = df.groupby("cluster_id").filter(check_group)
+    valid = (group_ids >= 0) & np.isin(group_ids, has_items) & ~np.isin(group_ids, bad_groups)
+    filtered_df = df[valid]
 
     return filtered_df
 
 
-# !!!!  next several functions are all related to parallel processing.  !!!
-
-
-def worker_function(group_data, filtered_organisationsrollen_df):
-    group, data = group_data
-    return add_singular_produkte_columns_group_simplified(
-        data, filtered_organisationsrollen_df
-    )
-
-
-def parallel_apply(
-    grouped_df, func, filtered_organisationsrollen_df, num_processes=None
-):
-    # Create a list of tuples (group_key, group_data)
-    group_list = [(group, data) for group, data in grouped_df]
-
-    # Partial function with fixed arguments
-    partial_func = partial(
-        func, filtered_organisationsrollen_df=filtered_organisationsrollen_df
-    )
-
-    # Create a pool of processes
-    pool = multiprocessing.Pool(processes=num_processes)
-
-    # Map the function to the chunks and collect the results
-    result_chunks = pool.map(partial_func, group_list)
-
-    # Close the pool and wait for work to finish
-    pool.close()
-    pool.join()
-
-    # Concatenate the results
-    return pd.concat(result_chunks)
-
-
 def get_product_information(df_input, organisationsrollen_df, produktname):
-    # uses parallel processing to utilize 100% CPU, takes several minutes for one produkt.
-
-    # Pre-filter organisationsrollen_df by produktname
+    # One hash join of all cluster members with the roles of the produkt, no per-row scans needed.
     full_id = produkte_dict_name_first.get(produktname, None)
     if not full_id:
         raise ValueError(f"Produkt '{produktname}' not found in produkte_dict")
 
-    filtered_organisationsrollen_df = organisationsrollen_df[
-        organisationsrollen_df["FullID"] == full_id
-    ]
+    role_index = build_product_role_index(organisationsrollen_df, [full_id])
 
-    grouped_df = df_input.groupby("cluster_id")
-    result_df = parallel_apply(
-        grouped_df, worker_function, filtered_organisationsrollen_df
-    ).reset_index(drop=True)
+    # same row order as the former groupby("cluster_id") + concat
+    df_input = df_input[df_input["cluster_id"].notna()].sort_values(
+        "cluster_id", kind="stable"
+    )
+    result_df = add_product_role_columns(df_input, role_index).reset_index(drop=True)
 
     return result_df
 
 
 def batch_process_produkte(df, organisationsrollen_df, produktnamen):
     """
-    First calls get_product_information() to get Produkt information for every row (slow part).
-    Then calls two variations of cleanup functions that check if any group of Doubletten has either all 3 roles for a product or only 2 roles.
+    Gets the Produkt information for every row and all produkte in one pass (see get_product_information()).
+    Then calls two variations of cleanup functions that check if any group of Doubletten has either all 3 roles for a product or only 2 roles,
+    grouped by (FullID, cluster_id).
     After this we still have a single dataframe for one product. Further processing below is to split it up into different "muster".
     """
+    full_ids = {}
+    for produktname in produktnamen:
+        full_id = produkte_dict_name_first.get(produktname, None)
+        if not full_id:
+            raise ValueError(f"Produkt '{produktname}' not found in produkte_dict")
+        full_ids[produktname] = full_id
+
+    role_index = build_product_role_index(organisationsrollen_df, list(full_ids.values()))
+
+    # Same row order (and index) as get_product_information() for each produkt
+    df = df[df["cluster_id"].notna()].sort_values("cluster_id", kind="stable")
+    df = df.reset_index(drop=True).reset_index()
+
+    # Only clusters with at least one role of a produkt can pass the cleanup functions
+    member_products = role_index[["RefID", "FullID"]].drop_duplicates().merge(
+        df[["ReferenceID", "cluster_id"]], left_on="RefID", right_on="ReferenceID"
+    )
+    product_clusters = member_products[["FullID", "cluster_id"]].drop_duplicates()
+    product_info = df.merge(product_clusters, on="cluster_id")
+    product_info = add_product_role_columns(product_info, role_index, by_product=True)
+    product_info = product_info.sort_values(["FullID", "index"]).set_index("index")
+    product_info.index.name = None
+
+    cleaned_3 = cleanup_produkte_columns(product_info, ["FullID", "cluster_id"])
+    cleaned_2 = cleanup_produkte_columns_only_2_roles(product_info, ["FullID", "cluster_id"])
+    cleaned_3 = dict(tuple(cleaned_3.groupby("FullID", sort=False)))
+    cleaned_2 = dict(tuple(cleaned_2.groupby("FullID", sort=False)))
+
     result_3 = {}
     result_2 = {}
-    for produktname in produktnamen:
-        product_info = get_product_information(df, organisationsrollen_df, produktname)
+    for produktname, full_id in full_ids.items():
         print(f"✅ Done with {produktname}")
-        cleaned_product_info_3 = cleanup_produkte_columns(product_info)
-        cleaned_product_info_2 = cleanup_produkte_columns_only_2_roles(product_info)
-
-        if cleaned_product_info_3.empty:
+        if full_id not in cleaned_3:
             print(f"❌ No Doubletten with 3 roles found!")
         else:
-            result_3[produktname] = cleaned_product_info_3
+            result_3[produktname] = cleaned_3[full_id].drop(columns="FullID")
 
-        if cleaned_product_info_2.empty:
+        if full_id not in cleaned_2:
             print(f"❌ No Doubletten with 2 roles found!")
         else:
-            result_2[produktname] = cleaned_product_info_2
-            
+            result_2[produktname] = cleaned_2[full_id].drop(columns="FullID")
+
     return result_3, result_2
 
 
@@ -510,6 +549,109 @@ def batch_process_produkte(df, organisationsrollen_df, produktnamen):
 #     return df_list, df_list_names
 
 
+objekt_columns = ["Inhaber_Objekt", "Rechempf_Objekt", "Korrempf_Objekt"]
+produktid_columns = ["Inhaber_ProduktID", "Rechempf_ProduktID", "Korrempf_ProduktID"]
+
+
+def produkte_element_table(df):
+    """
+    Shared engine of the split_produkte_groups functions, works on the long format of the list columns.
+    One row per (cluster, member, element) where the member has the element in at least one role, with
+    - row: position of the member in df, new_cluster_id: cluster_id + suffix of the element ("_a", "_b", ... by sorted elements)
+    - one boolean column per role (Inhaber_Objekt, ...) and the matching ProduktID (first occurrence, "" if missing)
+    - member_roles: number of roles of the member for this element
+    - n_Inhaber_Objekt, ...: number of members with that role for the element in the cluster, n_members: members with any role
+    Sorted by cluster_id, element suffix and member order.
+    """
+    alphabet = list(string.ascii_lowercase)
+    suffixes = np.array(alphabet + [i + j for i in alphabet for j in alphabet])
+
+    group_ids, long_df = produkte_long_table(df, "cluster_id", objekt_columns)
+    long_df = long_df[long_df["group"] >= 0]
+    long_df["position"] = long_df.groupby(["role", "row"]).cumcount()
+    long_df = long_df.drop_duplicates(["row", "item", "role"])
+
+    # ProduktID at the position of the first occurrence of the element
+    produktids = []
+    for objekt_col, id_col in zip(objekt_columns, produktid_columns):
+        lengths = df[id_col].str.len().to_numpy()
+        ids = pd.DataFrame(
+            {
+                "row": np.repeat(np.arange(len(df)), lengths),
+                "produktid": list(chain.from_iterable(df[id_col])),
+                "role": objekt_col,
+            }
+        )
+        ids["position"] = ids.groupby("row").cumcount()
+        produktids.append(ids)
+    long_df = long_df.merge(
+        pd.concat(produktids, ignore_index=True),
+        on=["role", "row", "position"],
+        how="left",
+    )
+    long_df["produktid"] = long_df["produktid"].astype(object).where(
+        long_df["produktid"].notna(), ""
+    )
+
+    element_df = long_df.pivot(
+        index=["group", "row", "item"], columns="role", values="produktid"
+    ).reindex(columns=objekt_columns)
+    element_df.columns.name = None
+    for objekt_col, id_col in zip(objekt_columns, produktid_columns):
+        element_df[id_col] = element_df[objekt_col].astype(object).where(
+            element_df[objekt_col].notna(), ""
+        )
+        element_df[objekt_col] = element_df[objekt_col].notna()
+    element_df = element_df.reset_index()
+
+    element_df["member_roles"] = element_df[objekt_columns].sum(axis=1)
+    per_element = element_df.groupby(["group", "item"], sort=False)
+    for objekt_col in objekt_columns:
+        element_df[f"n_{objekt_col}"] = per_element[objekt_col].transform("sum")
+    element_df["n_members"] = per_element["row"].transform("size")
+
+    # suffix by the sorted string representation of the elements within the cluster
+    elements = element_df[["group", "item"]].drop_duplicates()
+    elements["item_str"] = elements["item"].map(str)
+    elements = elements.sort_values(["group", "item_str"], kind="stable")
+    elements["suffix_position"] = elements.groupby("group").cumcount()
+    elements["suffix_position"] = elements.groupby(["group", "item_str"])[
+        "suffix_position"
+    ].transform("max")
+    element_df = element_df.merge(
+        elements[["group", "item", "suffix_position"]], on=["group", "item"]
+    )
+
+    cluster_ids = df["cluster_id"].to_numpy()[element_df["row"]]
+    element_df["cluster_order"] = (
+        df.groupby("cluster_id").ngroup().to_numpy()[element_df["row"]]
+    )
+    element_df["new_cluster_id"] = [
+        f"{cluster_id}_{suffix}"
+        for cluster_id, suffix in zip(
+            cluster_ids, suffixes[element_df["suffix_position"]]
+        )
+    ]
+    element_df.sort_values(
+        ["cluster_order", "suffix_position", "row"], kind="stable", inplace=True
+    )
+    return element_df.reset_index(drop=True)
+
+
+def produkte_element_rows(df, element_df):
+    """
+    Output rows of the split_produkte_groups functions for the given rows of produkte_element_table():
+    the member with the new cluster_id and, per role, the element and its ProduktID (or "" if the member lacks the role).
+    """
+    rows = df.iloc[element_df["row"].to_numpy()].reset_index(drop=True)
+    rows["cluster_id"] = element_df["new_cluster_id"].to_numpy()
+    for objekt_col, id_col in zip(objekt_columns, produktid_columns):
+        has_role = element_df[objekt_col].to_numpy()
+        rows[objekt_col] = np.where(has_role, element_df["item"].to_numpy(), "")
+        rows[id_col] = np.where(has_role, element_df[id_col].to_numpy(), "")
+    return rows
+
+
 def split_produkte_groups(df):
     """
     Commented-out version above works, but was meant for clusters of size 2 and has outdated numbering and filtering scheme.
@@ -517,140 +659,33 @@ def split_produkte_groups(df):
     Discards group members that have no role (or that have all three roles).
     Organizes them into list with 3 dataframes.
     """
-    df_inhaber_separat = pd.DataFrame(columns=df.columns)
-    df_rechempf_separat = pd.DataFrame(columns=df.columns)
-    df_korrempf_separat = pd.DataFrame(columns=df.columns)
+    element_df = produkte_element_table(df)
 
-    alphabet = list(string.ascii_lowercase)
-    suffixes = alphabet + [i + j for i in alphabet for j in alphabet]
-
-    for cluster_id, group in df.groupby("cluster_id"):
-        unique_elements = set()
-        for member in group.itertuples():
-            for col in ["Inhaber_Objekt", "Rechempf_Objekt", "Korrempf_Objekt"]:
-                unique_elements.update(getattr(member, col))
-
-        sorted_elements = sorted(map(str, unique_elements))
-        suffix_dict = {
-            elem: f"_{suffixes[i]}" for i, elem in enumerate(sorted_elements)
-        }
-
-        for element in unique_elements:
-            element_roles = {
-                col: set()
-                for col in ["Inhaber_Objekt", "Rechempf_Objekt", "Korrempf_Objekt"]
-            }
-            for member in group.itertuples():
-                for col in element_roles.keys():
-                    if element in getattr(member, col):
-                        element_roles[col].add(member.Index)
-
-            # Ensure roles are distributed across exactly two members and all three roles are covered
-            if (
-                sum(len(roles) for roles in element_roles.values()) == 3
-                and len({idx for roles in element_roles.values() for idx in roles}) == 2
-            ):
-                # Determine which member has which role(s)
-                member_roles_count = {
-                    member: sum(member in roles for roles in element_roles.values())
-                    for member in group.index
-                }
+    # Roles are distributed across exactly two members and all three roles are covered
+    n_roles = element_df[[f"n_{col}" for col in objekt_columns]].sum(axis=1)
+    element_df = element_df[(n_roles == 3) & (element_df["n_members"] == 2)]
 
-                # Find the member with a single role and two roles
-                single_role_member = next(
-                    (
-                        member
-                        for member, count in member_roles_count.items()
-                        if count == 1
-                    ),
-                    None,
-                )
-                two_roles_member = next(
-                    (
-                        member
-                        for member, count in member_roles_count.items()
-                        if count == 2
-                    ),
-                    None,
-                )
-
-                # This checks which dataframe to append based on the role of the single_role_member
-                if single_role_member is not None and two_roles_member is not None:
-                    for role, members in element_roles.items():
-                        if single_role_member in members:
-                            single_role = role
-                            break
-
-                    for member in group.itertuples():
-                        if member.Index in [single_role_member, two_roles_member]:
-                            new_row = {
-                                col: getattr(member, col)
-                                for col in df.columns
-                                if col
-                                not in [
-                                    "Inhaber_Objekt",
-                                    "Rechempf_Objekt",
-                                    "Korrempf_Objekt",
-                                    "Inhaber_ProduktID",
-                                    "Rechempf_ProduktID",
-                                    "Korrempf_ProduktID",
-                                ]
-                            }
-                            new_row["cluster_id"] = (
-                                f"{cluster_id}{suffix_dict[str(element)]}"
-                            )
-
-                            for col, id_col in zip(
-                                [
-                                    "Inhaber_Objekt",
-                                    "Rechempf_Objekt",
-                                    "Korrempf_Objekt",
-                                ],
-                                [
-                                    "Inhaber_ProduktID",
-                                    "Rechempf_ProduktID",
-                                    "Korrempf_ProduktID",
-                                ],
-                            ):
-                                if element in getattr(member, col):
-                                    index = getattr(member, col).index(element)
-                                    new_row[col] = element
-                                    new_row[id_col] = (
-                                        getattr(member, id_col)[index]
-                                        if index < len(getattr(member, id_col))
-                                        else ""
-                                    )
-                                else:
-                                    new_row[col] = ""
-                                    new_row[id_col] = ""
-
-                            new_row_df = pd.DataFrame([new_row])
-
-                            # Assign to the correct dataframe based on the single_role
-                            if single_role == "Inhaber_Objekt":
-                                df_inhaber_separat = pd.concat(
-                                    [df_inhaber_separat, new_row_df], ignore_index=True
-                                )
-                            elif single_role == "Rechempf_Objekt":
-                                df_rechempf_separat = pd.concat(
-                                    [df_rechempf_separat, new_row_df], ignore_index=True
-                                )
-                            elif single_role == "Korrempf_Objekt":
-                                df_korrempf_separat = pd.concat(
-                                    [df_korrempf_separat, new_row_df], ignore_index=True
-                                )
+    # The dataframe is chosen by the role of the member with a single role
+    single_role = np.select(
+        [element_df[col] for col in objekt_columns], objekt_columns, default=""
+    )
+    single_role = pd.Series(
+        np.where(element_df["member_roles"] == 1, single_role, ""),
+        index=element_df.index,
+    )
+    single_role = single_role.groupby(
+        [element_df["group"], element_df["item"]], sort=False
+    ).transform("max")
 
     df_list = []
     df_list_names = []
-    if not df_inhaber_separat.empty:
-        df_list.append(df_inhaber_separat)
-        df_list_names.append("Inhaber_Separat")
-    if not df_rechempf_separat.empty:
-        df_list.append(df_rechempf_separat)
-        df_list_names.append("Rechempf_Separat")
-    if not df_korrempf_separat.empty:
-        df_list.append(df_korrempf_separat)
-        df_list_names.append("KorrEmpf_Separat")
+    for role, name in zip(
+        objekt_columns, ["Inhaber_Separat", "Rechempf_Separat", "KorrEmpf_Separat"]
+    ):
+        selected = element_df[single_role == role]
+        if not selected.empty:
+            df_list.append(produkte_element_rows(df, selected))
+            df_list_names.append(name)
 
     return df_list, df_list_names
 
@@ -716,9 +751,6 @@ def split_produkte_groups(df):
 
 #     return df_list, df_list_names
 
-import string
-
-
 def split_produkte_groups_two_roles(df):
     """
     Organizes the DataFrame into four new DataFrames based on common elements in two of the three roles.
@@ -726,157 +758,46 @@ def split_produkte_groups_two_roles(df):
     Members without a role are removed (although they are still doubletten, but must be handled elsewhere).
     Corresponding ProduktID for each Objekt element is also placed in the new row.
     """
-    # List columns that are expected to contain lists and their corresponding ProduktID columns
-    objekt_columns = ["Inhaber_Objekt", "Rechempf_Objekt", "Korrempf_Objekt"]
-    produktid_columns = [
-        "Inhaber_ProduktID",
-        "Rechempf_ProduktID",
-        "Korrempf_ProduktID",
-    ]
-    list_columns = objekt_columns + produktid_columns
-
-    # Initialize the four DataFrames
-    df_inhaber_korrempf = pd.DataFrame(columns=df.columns)
-    df_inhaber_rechempf = pd.DataFrame(columns=df.columns)
-    df_korrempf_rechempf = pd.DataFrame(columns=df.columns)
-    df_sonstige = pd.DataFrame(columns=df.columns)
-
-    alphabet = list(string.ascii_lowercase)
-    suffixes = alphabet + [i + j for i in alphabet for j in alphabet]
-
-    for cluster_id, group in df.groupby("cluster_id"):
-        unique_elements = set()
-        for member in group.itertuples():
-            for col in objekt_columns:
-                unique_elements.update(getattr(member, col))
-
-        # suffix_dict = {elem: f"_{suffixes[i]}" for i, elem in enumerate(sorted(unique_elements))}
-        sorted_elements = sorted(map(str, unique_elements))
-        suffix_dict = {
-            elem: f"_{suffixes[i]}" for i, elem in enumerate(sorted_elements)
-        }
-
-        for element in unique_elements:
-            element_roles = {col: set() for col in objekt_columns}
-            for member in group.itertuples():
-                for col in objekt_columns:
-                    if element in getattr(member, col):
-                        element_roles[col].add(member.Index)
-
-            for member in group.itertuples():
-                new_row = {
-                    col: getattr(member, col)
-                    for col in df.columns
-                    if col not in list_columns
-                }
-                new_row["cluster_id"] = f"{cluster_id}{suffix_dict[str(element)]}"
-
-                for col, id_col in zip(objekt_columns, produktid_columns):
-                    if element in getattr(member, col):
-                        index = getattr(member, col).index(element)
-                        new_row[col] = element
-                        new_row[id_col] = (
-                            getattr(member, id_col)[index]
-                            if index < len(getattr(member, id_col))
-                            else ""
-                        )
-                    else:
-                        new_row[col] = ""
-                        new_row[id_col] = ""
-
-                new_row_df = pd.DataFrame([new_row])
-
-                # only process rows that actually have a role:
-                if any(new_row[col] for col in objekt_columns):
-                    # Determine the DataFrame to which the row should be assigned
-                    if (
-                        len(element_roles["Inhaber_Objekt"]) > 1
-                        and len(element_roles["Rechempf_Objekt"]) > 1
-                    ):
-                        df_sonstige = pd.concat(
-                            [df_sonstige, new_row_df], ignore_index=True
-                        )
-                    elif (
-                        len(element_roles["Inhaber_Objekt"]) > 1
-                        and len(element_roles["Korrempf_Objekt"]) > 1
-                    ):
-                        df_sonstige = pd.concat(
-                            [df_sonstige, new_row_df], ignore_index=True
-                        )
-                    elif (
-                        len(element_roles["Rechempf_Objekt"]) > 1
-                        and len(element_roles["Korrempf_Objekt"]) > 1
-                    ):
-                        df_sonstige = pd.concat(
-                            [df_sonstige, new_row_df], ignore_index=True
-                        )
-                    elif (
-                        len(element_roles["Inhaber_Objekt"]) > 0
-                        and len(element_roles["Rechempf_Objekt"]) > 0
-                    ):
-                        if new_row["Inhaber_Objekt"] and new_row["Rechempf_Objekt"]:
-                            df_sonstige = pd.concat(
-                                [df_sonstige, new_row_df], ignore_index=True
-                            )
-                        else:
-                            df_inhaber_rechempf = pd.concat(
-                                [df_inhaber_rechempf, new_row_df], ignore_index=True
-                            )
-                    elif (
-                        len(element_roles["Inhaber_Objekt"]) > 0
-                        and len(element_roles["Korrempf_Objekt"]) > 0
-                    ):
-                        if new_row["Inhaber_Objekt"] and new_row["Korrempf_Objekt"]:
-                            df_sonstige = pd.concat(
-                                [df_sonstige, new_row_df], ignore_index=True
-                            )
-                        else:
-                            df_inhaber_korrempf = pd.concat(
-                                [df_inhaber_korrempf, new_row_df], ignore_index=True
-                            )
-                    elif (
-                        len(element_roles["Rechempf_Objekt"]) > 0
-                        and len(element_roles["Korrempf_Objekt"]) > 0
-                    ):
-                        if new_row["Rechempf_Objekt"] and new_row["Korrempf_Objekt"]:
-                            df_sonstige = pd.concat(
-                                [df_sonstige, new_row_df], ignore_index=True
-                            )
-                        else:
-                            df_korrempf_rechempf = pd.concat(
-                                [df_korrempf_rechempf, new_row_df], ignore_index=True
-                            )
-                    else:
-                        df_sonstige = pd.concat(
-                            [df_sonstige, new_row_df], ignore_index=True
-                        )
-
-    # Ensure there are no single-member groups in df_sonstige
-    df_sonstige = df_sonstige[df_sonstige.duplicated(subset="cluster_id", keep=False)]
-    df_korrempf_rechempf = df_korrempf_rechempf[
-        df_korrempf_rechempf.duplicated(subset="cluster_id", keep=False)
-    ]
-    df_inhaber_rechempf = df_inhaber_rechempf[
-        df_inhaber_rechempf.duplicated(subset="cluster_id", keep=False)
-    ]
-    df_inhaber_korrempf = df_inhaber_korrempf[
-        df_inhaber_korrempf.duplicated(subset="cluster_id", keep=False)
-    ]
+    element_df = produkte_element_table(df)
+    # only rows that actually have a role (an empty element counts as no role)
+    element_df = element_df[element_df["item"].map(bool)]
+
+    n_inhaber = element_df["n_Inhaber_Objekt"]
+    n_rechempf = element_df["n_Rechempf_Objekt"]
+    n_korrempf = element_df["n_Korrempf_Objekt"]
+    inhaber = element_df["Inhaber_Objekt"]
+    rechempf = element_df["Rechempf_Objekt"]
+    korrempf = element_df["Korrempf_Objekt"]
+
+    # Determine the DataFrame to which each row should be assigned,
+    # a member that has both roles of the pair is Sonstige
+    target = np.select(
+        [
+            ((n_inhaber > 1) & (n_rechempf > 1))
+            | ((n_inhaber > 1) & (n_korrempf > 1))
+            | ((n_rechempf > 1) & (n_korrempf > 1)),
+            (n_inhaber > 0) & (n_rechempf > 0),
+            (n_inhaber > 0) & (n_korrempf > 0),
+            (n_rechempf > 0) & (n_korrempf > 0),
+        ],
+        [
+            "Sonstige",
+            np.where(inhaber & rechempf, "Sonstige", "Inhaber_RechEmpf"),
+            np.where(inhaber & korrempf, "Sonstige", "Inhaber_KorrEmpf"),
+            np.where(rechempf & korrempf, "Sonstige", "KorrEmpf_RechEmpf"),
+        ],
+        default="Sonstige",
+    )
 
     df_list = []
     df_list_names = []
-    if not df_inhaber_korrempf.empty:
-        df_list.append(df_inhaber_korrempf)
-        df_list_names.append("Inhaber_KorrEmpf")
-    if not df_inhaber_rechempf.empty:
-        df_list.append(df_inhaber_rechempf)
-        df_list_names.append("Inhaber_RechEmpf")
-    if not df_korrempf_rechempf.empty:
-        df_list.append(df_korrempf_rechempf)
-        df_list_names.append("KorrEmpf_RechEmpf")
-    if not df_sonstige.empty:
-        df_list.append(df_sonstige)
-        df_list_names.append("Sonstige")
+    for name in ["Inhaber_KorrEmpf", "Inhaber_RechEmpf", "KorrEmpf_RechEmpf", "Sonstige"]:
+        selected = produkte_element_rows(df, element_df[target == name])
+        # Ensure there are no single-member groups
+        selected = selected[selected.duplicated(subset="cluster_id", keep=False)]
+        if not selected.empty:
+            df_list.append(selected)
+            df_list_names.append(name)
 
     return df_list, df_list_names
 
@@ -886,96 +807,20 @@ def split_produkte_groups_komplette_doublette(df):
     Checks if cluster_id groups of input df have all three roles for a product for one member each.
     Discards additional members that have no role or groups that don't match the criteria.
     """
-    # List columns that are expected to contain lists and their corresponding ProduktID columns
-    objekt_columns = ["Inhaber_Objekt", "Rechempf_Objekt", "Korrempf_Objekt"]
-    produktid_columns = [
-        "Inhaber_ProduktID",
-        "Rechempf_ProduktID",
-        "Korrempf_ProduktID",
-    ]
-    list_columns = objekt_columns + produktid_columns
+    element_df = produkte_element_table(df)
 
-    # Initialize the two DataFrames
-    df_komplette_doubletten = pd.DataFrame(columns=df.columns)
-    df_sonstige = pd.DataFrame(columns=df.columns)
-
-    alphabet = list(string.ascii_lowercase)
-    suffixes = alphabet + [i + j for i in alphabet for j in alphabet]
-
-    for cluster_id, group in df.groupby("cluster_id"):
-        unique_elements = set()
-        for member in group.itertuples():
-            for col in objekt_columns:
-                unique_elements.update(getattr(member, col))
-
-        sorted_elements = sorted(map(str, unique_elements))
-        suffix_dict = {
-            elem: f"_{suffixes[i]}" for i, elem in enumerate(sorted_elements)
-        }
-
-        for element in unique_elements:
-            element_roles = {col: set() for col in objekt_columns}
-            for member in group.itertuples():
-                for col in objekt_columns:
-                    if element in getattr(member, col):
-                        element_roles[col].add(member.Index)
-
-            for member in group.itertuples():
-                roles_per_member = {
-                    member.Index: len(
-                        [
-                            col
-                            for col in objekt_columns
-                            if member.Index in element_roles[col]
-                        ]
-                    )
-                    for member in group.itertuples()
-                }
-                if (
-                    len(
-                        [
-                            role_count
-                            for role_count in roles_per_member.values()
-                            if role_count == 1
-                        ]
-                    )
-                    == 3
-                ):
-                    # Check if member has a role for the given element
-                    if any(
-                        member.Index in element_roles[col] for col in objekt_columns
-                    ):
-                        new_row = {
-                            col: getattr(member, col)
-                            for col in df.columns
-                            if col not in list_columns
-                        }
-                        new_row["cluster_id"] = (
-                            f"{cluster_id}{suffix_dict[str(element)]}"
-                        )
-
-                        for col, id_col in zip(objekt_columns, produktid_columns):
-                            if element in getattr(member, col):
-                                index = getattr(member, col).index(element)
-                                new_row[col] = element
-                                new_row[id_col] = (
-                                    getattr(member, id_col)[index]
-                                    if index < len(getattr(member, id_col))
-                                    else ""
-                                )
-                            else:
-                                new_row[col] = ""
-                                new_row[id_col] = ""
-
-                        new_row_df = pd.DataFrame([new_row])
-                        df_komplette_doubletten = pd.concat(
-                            [df_komplette_doubletten, new_row_df], ignore_index=True
-                        )
+    # exactly three members with a single role for the element
+    n_single = (
+        (element_df["member_roles"] == 1)
+        .groupby([element_df["group"], element_df["item"]], sort=False)
+        .transform("sum")
+    )
+    element_df = element_df[n_single == 3]
 
     df_list = []
     df_list_names = []
-    if not df_komplette_doubletten.empty:
-        df_list.append(df_komplette_doubletten)
+    if not element_df.empty:
+        df_list.append(produkte_element_rows(df, element_df))
         df_list_names.append("Komplette_Doubletten")
 
     return df_list, df_list_names
@@ -983,32 +828,10 @@ def split_produkte_groups_komplette_doublette(df):
 
 def reorder_format_produkte_columns(xx):
     """
-    Creates 6 columns at the end of the dataframe, containing for each role the product name and its RefID.
+    Creates 6 columns at the start of the dataframe, containing for each role the product name and its RefID.
+    Each row is repeated for the longest of its lists, shorter lists are padded with "".
     For split_produkte_groups_two_roles this is no longer needed.
     """
-
-    def expand_row(row):
-        # Finding the length of the longest list in the row among the specified list columns
-        max_len = max(
-            [len(row[col]) for col in list_columns if col in row] + [1]
-        )  # Ensure at least length 1
-
-        # Creating a dictionary to hold the expanded data
-        expanded_data = {}
-
-        # Expanding the list columns
-        for col in list_columns:
-            expanded_data[col] = (
-                (row[col] + [""] * max_len)[:max_len] if col in row else [""] * max_len
-            )
-
-        # Expanding other columns by repeating their values
-        for col in row.index:
-            if col not in list_columns:
-                expanded_data[col] = [row[col]] * max_len
-
-        return pd.DataFrame(expanded_data)
-
     list_columns = [
         "Inhaber_Objekt",
         "Inhaber_ProduktID",
@@ -1017,17 +840,34 @@ def reorder_format_produkte_columns(xx):
         "Korrempf_Objekt",
         "Korrempf_ProduktID",
     ]
-    for col in list_columns:
-        xx[col] = xx[col].apply(lambda lst: [str(item) for item in lst])
-
-    expanded_df = pd.concat([expand_row(row) for _, row in xx.iterrows()]).reset_index(
-        drop=True
+    lengths = np.column_stack([xx[col].str.len().to_numpy() for col in list_columns])
+    max_len = np.maximum(lengths.max(axis=1, initial=0), 1)  # Ensure at least length 1
+
+    # Padded lists are flattened once, other columns are repeated by index
+    expanded_lists = {
+        col: list(
+            chain.from_iterable(
+                [str(item) for item in lst] + [""] * (n - len(lst))
+                for lst, n in zip(xx[col], max_len)
+            )
+        )
+        for col in list_columns
+    }
+    other_columns = xx.drop(columns=list_columns).iloc[
+        np.repeat(np.arange(len(xx)), max_len)
+    ]
+    expanded_df = pd.concat(
+        [pd.DataFrame(expanded_lists), other_columns.reset_index(drop=True)], axis=1
     )
 
-    # Create an auxiliary column for sorting
-    expanded_df["sort_key"] = expanded_df.apply(
-        lambda x: x["Inhaber_Objekt"] or x["Rechempf_Objekt"] or x["Korrempf_Objekt"],
-        axis=1,
+    # Auxiliary column for sorting: first non-empty Objekt
+    expanded_df["sort_key"] = (
+        expanded_df["Inhaber_Objekt"]
+        .where(expanded_df["Inhaber_Objekt"] != "", expanded_df["Rechempf_Objekt"])
+        .where(
+            (expanded_df["Inhaber_Objekt"] != "") | (expanded_df["Rechempf_Objekt"] != ""),
+            expanded_df["Korrempf_Objekt"],
+        )
     )
 
     # Sort by the new column and then by 'master'
@@ -1098,22 +938,41 @@ def organisationsrollen_filter_and_format(
     return df_list, df_list_names
 
 
+def format_produkt(df, rows_per_product=2, roles_per_product=3):
+    # Worker of organisationsrollen_filter_and_format_batch() for one Produkt, also returns its wall time.
+    start_time = time.time()
+    df = set_master_flag(df)  # is needed for re-ordering
+    dataframes, names = organisationsrollen_filter_and_format(
+        df, rows_per_product=rows_per_product, roles_per_product=roles_per_product
+    )
+    return dataframes, names, time.time() - start_time
+
+
 def organisationsrollen_filter_and_format_batch(
-    df_dict, rows_per_product=2, roles_per_product=3
+    df_dict, rows_per_product=2, roles_per_product=3, backend="process", num_workers=None
 ):
     """
-    Processes any number of Produkte at once.
+    Processes any number of Produkte at once, concurrently on a worker pool (largest Produkte first, see execute_tasks()).
     Expects a dictionary, with the Produktname as key and the dataframe as value.
     Returns a dictionary with key = Produktname and value = list of dataframes (Inhaber_separat, etc.)
+    and the statistics (in the order of df_dict).
     """
+    keys = list(df_dict)
+    results = execute_tasks(
+        format_produkt,
+        [df_dict[key] for key in keys],
+        weights=[len(df_dict[key]) for key in keys],
+        backend=backend,
+        num_workers=num_workers,
+        tasks_per_worker=None,
+        rows_per_product=rows_per_product,
+        roles_per_product=roles_per_product,
+    )
+
     result_dict = {}
     statistics_data = []
-    
-    for key, df in df_dict.items():
-        df = set_master_flag(df)  # is needed for re-ordering
-        dataframes, names = organisationsrollen_filter_and_format(
-            df, rows_per_product=rows_per_product, roles_per_product=roles_per_product
-        )
+    for key, (dataframes, names, wall_time) in zip(keys, results):
+        print(f"{key}: {wall_time:.1f}s")
 
         # Check if dataframes and names lists are not empty and have the same length
         if dataframes and names and len(dataframes) == len(names):
@@ -1123,8 +982,8 @@ def organisationsrollen_filter_and_format_batch(
             result_dict[key] = nested_dict
         else:
             result_dict[key] = {}  # Or some other placeholder if no data is present
-    
-    # Calculate statistics
+
+        # Calculate statistics
         doubletten_count = sum(df["cluster_id"].nunique() for df in dataframes)
         statistics_data.append({"produkte": key, "Doubletten": doubletten_count})
 
@@ -1136,60 +995,104 @@ def organisationsrollen_filter_and_format_batch(
 # ---------  Filters for other analyses  ---------
 
 
-def find_portal_vs_physisch_doublette(df, organisationen=False, strict_email=True, only_Geschaeftspartner=False):
+def add_doubletten_keys(df, organisationen=False):
+    # Hashed name/address/email keys (see add_name_variant_keys()), computed here if the processed data is older.
+    if not {"name_key", "address_key", "email_key"} <= set(df.columns):
+        df = add_name_variant_keys(df, name_column="Name_Zeile2" if organisationen else "Name")
+    return df
+
+
+def cluster_features(df, organisationen=False, key_columns=("name_key", "address_key", "email_key")):
+    """
+    Counts per group of key_columns (missing keys kept), computed in one groupby:
+    size, n_portal, n_physisch, n_partner (with Geschaeftspartner) and n_empty_email (EMailAdresse == "").
+    find_portal_vs_physisch_doublette() (strict and relaxed email) and find_email_doubletten() (portal and physisch)
+    roll this table up to their clusters, so it can be computed once per df and passed to them as features=.
+    """
+    key_columns = list(key_columns)
+    if not set(key_columns) <= set(df.columns):
+        df = add_doubletten_keys(df, organisationen)
+
+    versandart = df["Versandart"]
+    if "Geschaeftspartner_list" in df.columns:
+        partner = df["Geschaeftspartner_list"].str.len() > 0
+    else:
+        partner = pd.Series(False, index=df.index)
+    counts = pd.DataFrame(
+        {
+            "size": 1,
+            "n_portal": (versandart == "Portal").astype(int),
+            "n_physisch": (versandart == "Physisch").astype(int),
+            "n_partner": partner.astype(int),
+            "n_empty_email": (df["EMailAdresse"] == "").astype(int),
+        },
+        index=df.index,
+    )
+    return counts.groupby([df[column] for column in key_columns], dropna=False).sum()
+
+
+def cluster_positions(clusters, keys):
+    # Position of each row's key in the index of rolled up clusters (same as ngroup()), NaN for missing keys.
+    if isinstance(clusters, pd.MultiIndex):
+        positions = clusters.get_indexer(pd.MultiIndex.from_frame(keys))
+    else:
+        positions = clusters.get_indexer(keys.iloc[:, 0])
+    return pd.Series(positions, index=keys.index).where(positions >= 0)
+
+
+def find_portal_vs_physisch_doublette(
+    df, organisationen=False, strict_email=True, only_Geschaeftspartner=False, features=None
+):
     """
     Find doubletten (same name, adresse, email) that are present as physisch and portal
     (in case of personen irrespective of their connections to organisationen).
     If strict_email is True, require identical email. If False, relax this condition.
+    features: cluster_features() of df, to reuse it across calls (computed here if None).
+    Note: cluster_id is also written to the input df.
     """
-    # Determine grouping columns based on strict_email and organisationen flags
-    if organisationen:
-        group_columns = ["Name_Zeile2", "address_full"]
-    else:
-        group_columns = ["Name", "address_full"]
+    df = add_doubletten_keys(df, organisationen)
+    if features is None:
+        features = cluster_features(df)
 
+    # Determine grouping columns (hashed keys) based on strict_email
+    group_columns = ["name_key", "address_key"]
     if strict_email:
-        group_columns.append("EMailAdresse")
+        group_columns.append("email_key")
 
-    # Group by specified columns and assign cluster_id
-    df["cluster_id"] = df.groupby(group_columns).ngroup()
+    # Roll the features up to the clusters and assign cluster_id
+    grouped = features.groupby(level=group_columns)
+    counts = grouped.sum()
+    df["cluster_id"] = cluster_positions(counts.index, df[group_columns])
 
-    # Apply different filtering logic based on strict_email
     if not strict_email:
+        # Clusters with several different non-empty emails only keep the members without email
+        with_email = features.index.get_level_values("email_key").notna() & (features["n_empty_email"] == 0)
+        n_emails = pd.Series(with_email.astype(int), index=features.index).groupby(level=group_columns).sum()
+        counts_without_email = (
+            features[features["n_empty_email"] > 0]
+            .groupby(level=group_columns)
+            .sum()
+            .reindex(counts.index, fill_value=0)
+        )
+        counts = counts.where(np.broadcast_to((n_emails <= 1).to_numpy()[:, None], counts.shape), counts_without_email)
 
-        def filter_group(group):
-            non_empty_emails = group[group["EMailAdresse"] != ""]["EMailAdresse"]
-            if non_empty_emails.nunique() <= 1:
-                return group
-            else:
-                return group[group["EMailAdresse"] == ""]
-
-        df = df.groupby("cluster_id").apply(filter_group).reset_index(drop=True)
+        n_emails_row = df["cluster_id"].map(pd.Series(n_emails.to_numpy()))
+        df = df[(n_emails_row <= 1) | (df["EMailAdresse"] == "")]
+        df = df.sort_values("cluster_id", kind="stable").reset_index(drop=True)
 
-    # Keep only groups with at least 2 identical rows
-    filtered_df = df[df.groupby("cluster_id")["cluster_id"].transform("size") > 1]
+    # At least 2 identical rows, at least one with 'Versandart' == 'Portal' and at least one with 'Versandart' == 'Physisch'
+    valid = (counts["size"] > 1) & (counts["n_portal"] > 0) & (counts["n_physisch"] > 0)
 
-    # Check for at least one row with 'Versandart' == 'Portal' and at least one with 'Versandart' == 'Physisch' in each group
-    valid_clusters = filtered_df.groupby("cluster_id").apply(
-        lambda x: (x["Versandart"] == "Portal").any()
-        and (x["Versandart"] == "Physisch").any()
-    )
-    
     # If only_Geschaeftspartner is True, add additional condition
     if only_Geschaeftspartner:
-        valid_clusters &= filtered_df.groupby("cluster_id").apply(
-            lambda x: x["Geschaeftspartner_list"].apply(lambda gp: len(gp) > 0).any()
-        )
+        valid &= counts["n_partner"] > 0
 
-    # Filter out groups that don't meet both conditions
-    final_df = filtered_df[
-        filtered_df["cluster_id"].isin(valid_clusters[valid_clusters].index)
-    ]
+    final_df = df[df["cluster_id"].isin(np.flatnonzero(valid.to_numpy()))]
 
     return final_df
 
 
-def find_email_doubletten(df, portal=True, only_with_Geschaeftspartner=False):
+def find_email_doubletten(df, portal=True, only_with_Geschaeftspartner=False, features=None):
     """
     Simplified version of find_portal_vs_physisch_doublette().
     Doublette is simply defined by same email address.
@@ -1197,81 +1100,74 @@ def find_email_doubletten(df, portal=True, only_with_Geschaeftspartner=False):
     If portal=False, all must have Versandart == Physisch.
     They don't have to be connected to same organisation.
     If only_with_Geschaeftspartner=True, at least one member in each group must have Geschaeftspartner_list > 0.
+    features: cluster_features() of df (any key_columns including email_key), to reuse it across calls.
     """
     # We don't consider empty emails here
     df = df[df["EMailAdresse"] != ""]
+    if "email_key" not in df.columns:
+        df = df.assign(email_key=hash_key(df["EMailAdresse"]))
+    if features is None:
+        features = cluster_features(df, key_columns=["email_key"])
 
-    # Group by Email and assign cluster_id
-    df["cluster_id"] = df.groupby("EMailAdresse").ngroup()
+    # Roll the features up to the emails and assign cluster_id
+    counts = features[features["n_empty_email"] == 0].groupby(level="email_key").sum()
+    df = df.assign(cluster_id=cluster_positions(counts.index, df[["email_key"]]))
 
     # Keep only groups with at least 2 identical rows
-    filtered_df = df[df.groupby("cluster_id")["cluster_id"].transform("size") > 1]
-
-    # Check for at least one row with 'Versandart' == 'Portal' and at least one with 'Versandart' == 'Physisch' in each group
+    valid = counts["size"] > 1
     if portal:
-        valid_clusters = filtered_df.groupby("cluster_id").apply(
-            lambda x: (x["Versandart"] == "Portal").any()
-        )
+        valid &= counts["n_portal"] > 0
     else:
-        valid_clusters = filtered_df.groupby("cluster_id").apply(
-            lambda x: (x["Versandart"] == "Physisch").all()
-        )
+        valid &= counts["n_physisch"] == counts["size"]
 
     # If only_with_Geschaeftspartner is True, add additional condition
     if only_with_Geschaeftspartner:
-        valid_clusters &= filtered_df.groupby("cluster_id").apply(
-            lambda x: x["Geschaeftspartner_list"].apply(lambda gp: len(gp) > 0).any()
-        )
+        valid &= counts["n_partner"] > 0
+
+    final_df = df[df["cluster_id"].isin(np.flatnonzero(valid.to_numpy()))]
 
-    final_df = filtered_df[
-        filtered_df["cluster_id"].isin(valid_clusters[valid_clusters].index)
-    ]
-    
     return final_df
 
 
 # New Performance Test Functions
 
-def find_frequent_roles(organisationsrollen_df):
+def find_frequent_roles(organisationsrollen_df, min_count=1000):
     # Works for Organisationen and Personen
+    # One crosstab of (RefID, FullID) per role instead of a full scan per RefID and produkt.
     def create_role_df(role, role_ref_id):
         # Count occurrences of each unique ID in the specified role
         id_counts = organisationsrollen_df[role_ref_id].value_counts()
 
-        # Filter IDs that appear more than 1000 times
-        frequent_ids = id_counts[id_counts >= 1000].index
+        # Filter IDs that appear at least min_count times
+        frequent_ids = id_counts[id_counts >= min_count].index
+        frequent_df = organisationsrollen_df[
+            organisationsrollen_df[role_ref_id].isin(frequent_ids)
+        ]
 
-        # Initialize the result DataFrame
-        result_df = pd.DataFrame({
-            role_ref_id: frequent_ids,
-            "Total_Count": id_counts[frequent_ids]
-        })
+        # Role label of the first occurrence of each ID
+        labels = frequent_df.drop_duplicates(role_ref_id).set_index(role_ref_id)[role]
+        counts_per_produkt = pd.crosstab(frequent_df[role_ref_id], frequent_df["FullID"])
 
-        # Add the role column
-        result_df[role] = result_df[role_ref_id].apply(
-            lambda x: organisationsrollen_df.loc[
-                organisationsrollen_df[role_ref_id] == x, role
-            ].iloc[0]
+        result_df = pd.DataFrame(
+            {
+                role: labels.reindex(frequent_ids).to_numpy(),
+                role_ref_id: frequent_ids,
+                "Total_Count": id_counts[frequent_ids].to_numpy(),
+            }
         )
 
         # Add columns for each key in produkte_dict_name_first
         for produkt, full_id in produkte_dict_name_first.items():
-            result_df[produkt] = result_df[role_ref_id].apply(
-                lambda x: organisationsrollen_df[
-                    (organisationsrollen_df[role_ref_id] == x) & 
-                    (organisationsrollen_df["FullID"] == full_id)
-                ].shape[0]
-            )
+            if full_id in counts_per_produkt.columns:
+                result_df[produkt] = (
+                    counts_per_produkt[full_id].reindex(frequent_ids, fill_value=0).to_numpy()
+                )
+            else:
+                result_df[produkt] = 0
 
-        # Reorder columns
-        result_df = result_df[[role, role_ref_id, "Total_Count"] + list(produkte_dict_name_first.keys())]
-        
         # Remove columns where all counts are 0
         result_df = result_df.loc[:, (result_df != 0).any(axis=0)]
 
-        # Reset index to have a numeric index
-        result_df.reset_index(drop=True, inplace=True)
-
         return result_df
 
     # Create DataFrames for each role
@@ -1279,4 +1175,4 @@ def find_frequent_roles(organisationsrollen_df):
     rechnungsempfaenger_df = create_role_df("Rechnungsempfaenger", "Rechnungsempfaenger_RefID")
     korrespondenzempfaenger_df = create_role_df("Korrespondenzempfaenger", "Korrespondenzempfaenger_RefID")
 
-    return inhaber_df, rechnungsempfaenger_df, korrespondenzempfaenger_df
\ No newline at end of file
+    return inhaber_df, rechnungsempfaenger_df, korrespondenzempfaenger_df
@@ -1,46 +1,67 @@
+import numpy as np
 import pandas as pd
 
 from helper_functions.filter_muster_organisationen import general_exclusion_criteria_personen
 
 
 
-def filter_personen_connected_to_same_organisation(df_personen, df_organisationen):
+def filter_personen_connected_to_same_organisation(df_personen, df_organisationen, return_warnings=False):
     """
     A first step: Resulting groups will all be connected to the same organisation in some way.
     Later one can simply count "Verknuefpungsart", e.g. 1 Administrator + 1 Mitarbeiter.
     
     New cluster_id: If two or more members share organisation x they become 1_a, 
     if there are two or more others (still doubletten in terms of name/address) connected to organisation x' they become 1_b, etc.
+
+    Personen whose (first) VerknuepftesObjektID is not a ReferenceID in df_organisationen are collected in a warnings frame,
+    which is printed, or returned as second value with return_warnings=True.
     """
-    output_df = pd.DataFrame()
-    alphabet = list('abcdefghijklmnopqrstuvwxyz')
-    
-    grouped = df_personen.groupby('cluster_id')
-    
-    for cluster_id, group in grouped:
-        unique_ids = group['VerknuepftesObjektID_list'].apply(lambda x: x[0]).unique()
-        suffix_index = 0  # Initialize suffix index
-        
-        for unique_id in unique_ids:
-            subgroup = group[group['VerknuepftesObjektID_list'].apply(lambda x: x[0] == unique_id)]
-            # Check if VerknuepftesObjektID matches any ReferenceID in df_organisationen
-            if df_organisationen['ReferenceID'].isin([unique_id]).any():
-                if len(subgroup) >= 2:
-                    new_cluster_id = f"{cluster_id}_{alphabet[suffix_index]}"
-                    subgroup['cluster_id'] = new_cluster_id
-                    output_df = pd.concat([output_df, subgroup])
-                    suffix_index += 1  # Increment only when adding a subgroup
-            else:
-                for _, row in subgroup.iterrows():
-                    print(f"Warning: {row['Name']} has no matching organisation for {row['VerknuepftesObjektID']}")
-    
+    alphabet = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+    df = df_personen[df_personen['cluster_id'].notna()]
+    org_id = df['VerknuepftesObjektID_list'].str[0]
+    matched = org_id.isin(set(df_organisationen['ReferenceID']))
+    position = pd.Series(np.arange(len(df)), index=df.index)
+    keys = [df['cluster_id'], org_id]
+
+    # Subgroups (cluster_id, org_id) in the order clusters / first appearance of org_id / rows
+    subgroup_size = position.groupby(keys, dropna=False).transform('size')
+    first_position = position.groupby(keys, dropna=False).transform('min')
+    order = (
+        pd.DataFrame({'cluster_id': df['cluster_id'], 'first': first_position, 'position': position})
+        .sort_values(['cluster_id', 'first', 'position'], kind='stable')
+        .index
+    )
+
+    keep = (matched & (subgroup_size >= 2)).loc[order]
+    output_df = df.loc[order][keep.to_numpy()].copy()
+    # Suffix: rank of the subgroup within its cluster, counting only kept subgroups
+    suffix_index = (
+        first_position.loc[order][keep.to_numpy()]
+        .groupby(output_df['cluster_id'].to_numpy())
+        .rank(method='dense')
+        .astype(int)
+        .to_numpy()
+        - 1
+    )
+    output_df['cluster_id'] = output_df['cluster_id'].astype(str) + '_' + alphabet[suffix_index]
+
     # Reset index for clarity
     output_df.reset_index(drop=True, inplace=True)
     
     # Ensure the cluster_id column is the only one or appropriately named
     if 'modified_cluster_id' in output_df.columns:
         output_df.drop(columns=['modified_cluster_id'], inplace=True)
-    
+
+    unmatched = ~matched.loc[order].to_numpy()
+    warning_columns = [column for column in ['cluster_id', 'Name', 'VerknuepftesObjektID'] if column in df.columns]
+    warnings_df = df.loc[order][unmatched][warning_columns].reset_index(drop=True)
+
+    if return_warnings:
+        return output_df, warnings_df
+    if not warnings_df.empty:
+        print(f"Warning: {len(warnings_df)} Personen have no matching organisation:")
+        print(warnings_df.to_string(index=False))
     return output_df
 
 
@@ -49,22 +70,14 @@ def split_groups_mitarbeiter_admnistrator(df):
     Input is a dataframe of personendoubletten, connected to the same organisation as either Mitarbeiter or Administrator.
     Output is a dict with three dataframes: only_Mitarbeiter, one_Administrator, multiple_Administrator.
     """
-    # Initialize empty DataFrames for each category
-    df_mitarbeiter_only = pd.DataFrame()
-    df_one_administrator = pd.DataFrame()
-    df_multiple_administrator = pd.DataFrame()
-
-    # Group by 'cluster_id'
-    for _, group in df.groupby('cluster_id'):
-        # Check the 'Verknuepfungsart_list' for each group
-        admin_count = sum('Administrator' in verknuepfungsart_list for verknuepfungsart_list in group['Verknuepfungsart_list'])
-        
-        if admin_count == 0:
-            df_mitarbeiter_only = pd.concat([df_mitarbeiter_only, group])
-        elif admin_count == 1:
-            df_one_administrator = pd.concat([df_one_administrator, group])
-        else:  # More than one 'Administrator'
-            df_multiple_administrator = pd.concat([df_multiple_administrator, group])
+    # Rows linked as Administrator, counted per cluster (clusters in sorted order, like groupby)
+    df = df[df['cluster_id'].notna()].sort_values('cluster_id', kind='stable')
+    is_admin = df['Verknuepfungsart_list'].map(lambda verknuepfungsart_list: 'Administrator' in verknuepfungsart_list)
+    admin_count = is_admin.astype(int).groupby(df['cluster_id']).transform('sum')
+
+    df_mitarbeiter_only = df[admin_count == 0]
+    df_one_administrator = df[admin_count == 1]
+    df_multiple_administrator = df[admin_count > 1]
 
     # Create output dictionary, omitting empty DataFrames
     output_dict = {}
@@ -85,3 +85,17 @@ produkte_dict_personen = {
     "B90ED2E5-14EA-4539-B4E6-FABFC915A113": "Rufzeichen SOLAS-Schiff",
     "978F554D-5DD4-4FA7-8654-E099D56304C2": "FDA",
 }
+
+
+# Rollen-Kolonnen der Expertensuchen und ihr Label (match_type) im Graph.
+organisationsrollen_columns = {
+    "Inhaber_RefID": "Inhaber",
+    "Rechnungsempfaenger_RefID": "Rechnungsempfaenger",
+    "Korrespondenzempfaenger_RefID": "Korrespondenzempfaenger",
+}
+
+personenrollen_columns = {
+    "Kontaktperson_RefID": "Kontaktperson",
+    "Technikperson_RefID": "Technikperson",
+    "Statistikperson_RefID": "Statistikperson",
+}
@@ -0,0 +1,158 @@
+# Worker pools and task scheduling shared by the batch functions, see execute_tasks().
+# Split out of filter_muster_organisationen so that analyses_formatting can use it without a circular import.
+import os
+import time
+import queue
+import atexit
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from functools import partial
+
+import numpy as np
+
+
+# Persistent worker pools, reused across calls of execute_tasks() until close_executor_pools().
+_executor_pools = {}
+
+
+def get_executor_pool(backend="thread", num_workers=None):
+    key = (backend, num_workers)
+    if key not in _executor_pools:
+        if backend == "process":
+            _executor_pools[key] = multiprocessing.Pool(processes=num_workers)
+        elif backend == "thread":
+            _executor_pools[key] = ThreadPool(processes=num_workers)
+        else:
+            raise ValueError(
+                f"Unknown backend '{backend}', use 'process', 'thread' or 'serial'"
+            )
+    return _executor_pools[key]
+
+
+def close_executor_pools():
+    for pool in _executor_pools.values():
+        pool.close()
+        pool.join()
+    _executor_pools.clear()
+
+
+# No orphaned worker processes when the interpreter / notebook kernel exits
+atexit.register(close_executor_pools)
+
+
+def make_task_batches(weights, num_batches):
+    """
+    Returns lists of task positions, largest tasks first.
+    Tasks are packed together until a batch reaches the total weight / num_batches,
+    so huge tasks get their own batch and many small ones share one.
+    """
+    weights = np.asarray(weights, dtype=float)
+    target = weights.sum() / max(num_batches, 1)
+    batches = []
+    current = []
+    current_weight = 0
+    for position in np.argsort(-weights, kind="stable"):
+        current.append(int(position))
+        current_weight += weights[position]
+        if current_weight >= target:
+            batches.append(current)
+            current = []
+            current_weight = 0
+    if current:
+        batches.append(current)
+    return batches
+
+
+def run_task_batch(func, kwargs, batch):
+    # batch is a list of (position, task), positions are used to restore the order of the results
+    return [(position, func(task, **kwargs)) for position, task in batch]
+
+
+def print_progress(done, total, start_time):
+    elapsed = time.time() - start_time
+    eta = elapsed / done * (total - done) if done else 0
+    print(
+        f"\r{done}/{total} tasks done, {elapsed:.0f}s elapsed, ETA {eta:.0f}s",
+        end="\n" if done == total else "",
+    )
+
+
+def bounded_imap_unordered(pool, func, payloads, window):
+    # Like pool.imap_unordered(), but at most window payloads are taken from the iterator (and prepared) before
+    # their results arrive, imap_unordered() would consume the whole iterator right away.
+    finished = queue.SimpleQueue()
+    payloads = iter(payloads)
+    in_flight = 0
+
+    def submit():
+        nonlocal in_flight
+        for payload in payloads:
+            pool.apply_async(func, (payload,), callback=finished.put, error_callback=finished.put)
+            in_flight += 1
+            return
+
+    for _ in range(window):
+        submit()
+    while in_flight:
+        result = finished.get()
+        in_flight -= 1
+        if isinstance(result, BaseException):
+            raise result
+        submit()
+        yield result
+
+
+def execute_tasks(
+    func,
+    tasks,
+    weights=None,
+    backend="thread",
+    num_workers=None,
+    tasks_per_worker=4,
+    prepare=None,
+    progress=True,
+    **kwargs,
+):
+    """
+    Runs func(task, **kwargs) for every task and returns the results in the order of tasks.
+    - weights (e.g. cluster sizes) are used to start the largest tasks first and to batch small ones,
+      about tasks_per_worker batches per worker (None: every task is its own batch, for a few large tasks).
+    - backend: "thread" (default) and "process" use a persistent pool (see get_executor_pool()), "serial" runs here.
+      With "process" (and on Windows in particular) func must be a module-level function so that it can be pickled.
+    - prepare(task) is called in this process just before a batch is sent, e.g. to cut a group out of a df.
+      At most 2 batches per worker are prepared or running at a time, so not all task inputs have to exist at once.
+    """
+    tasks = list(tasks)
+    if not tasks:
+        return []
+    if weights is None:
+        weights = [1] * len(tasks)
+    if prepare is None:
+        prepare = lambda task: task
+    workers = num_workers or os.cpu_count() or 1
+    if tasks_per_worker is None:
+        batches = [[int(position)] for position in np.argsort(-np.asarray(weights), kind="stable")]
+    else:
+        batches = make_task_batches(weights, workers * tasks_per_worker)
+    payloads = (
+        [(position, prepare(tasks[position])) for position in batch] for batch in batches
+    )
+    run_batch = partial(run_task_batch, func, kwargs)
+
+    if backend == "serial":
+        finished = map(run_batch, payloads)
+    else:
+        finished = bounded_imap_unordered(
+            get_executor_pool(backend, num_workers), run_batch, payloads, window=2 * workers
+        )
+
+    results = [None] * len(tasks)
+    start_time = time.time()
+    done = 0
+    for batch_results in finished:
+        for position, result in batch_results:
+            results[position] = result
+        done += len(batch_results)
+        if progress:
+            print_progress(done, len(tasks), start_time)
+    return results
@@ -0,0 +1,106 @@
+import pandas as pd
+import pytest
+
+from helper_functions.analyses_formatting import (
+    filter_verknuepfungen,
+    final_touch,
+    final_touch_batch,
+    renumber_and_sort_alphanumeric,
+    renumber_pairs,
+)
+
+LIST_COLUMNS = ["Verknuepfungsart_list", "VerknuepftesObjektID_list", "VerknuepftesObjekt_list"]
+COLS_TO_KEEP = ["cluster_id", "ReferenceID", "score", "master", "masterID", "Verknuepfungsart_list"]
+
+
+@pytest.fixture
+def doubletten_df():
+    return pd.DataFrame(
+        {
+            "cluster_id": [7, 7, 3, 3, 3],
+            "ReferenceID": ["A", "B", "C", "D", "E"],
+            "score": [1.0, 2.0, 5.0, 5.0, 1.0],
+            "CreatedAt": pd.to_datetime(["2020-01-01", "2021-01-01", "2019-01-01", "2022-01-01", "2023-01-01"]),
+            "Verknuepfungsart_list": [
+                ["Mitarbeiter", "Partner"],
+                [],
+                ["Administrator"],
+                ["Partner"],
+                ["Mitarbeiter", "Administrator"],
+            ],
+            "VerknuepftesObjektID_list": [["p1", "o1"], [], ["p2"], ["o2"], ["p3", "p4"]],
+            "VerknuepftesObjekt_list": [["P 1", "O 1"], [], ["P 2"], ["O 2"], ["P 3", "P 4"]],
+        },
+        index=[10, 11, 12, 13, 14],
+    )
+
+
+def empty_frame(df):
+    return df.iloc[:0]
+
+
+def test_filter_verknuepfungen(doubletten_df):
+    result = filter_verknuepfungen(doubletten_df)
+    assert result["Verknuepfungsart_list"].tolist() == [
+        ["Mitarbeiter"], [], ["Administrator"], [], ["Mitarbeiter", "Administrator"]
+    ]
+    assert result["VerknuepftesObjektID_list"].tolist() == [["p1"], [], ["p2"], [], ["p3", "p4"]]
+    assert result["VerknuepftesObjekt_list"].tolist() == [["P 1"], [], ["P 2"], [], ["P 3", "P 4"]]
+    assert result.index.equals(doubletten_df.index)
+    # input unchanged
+    assert doubletten_df["Verknuepfungsart_list"].iloc[0] == ["Mitarbeiter", "Partner"]
+
+
+def test_filter_verknuepfungen_empty(doubletten_df):
+    df = empty_frame(doubletten_df)
+    result = filter_verknuepfungen(df)
+    assert result.empty
+    assert result is not df
+    assert list(result.columns) == list(df.columns)
+
+
+def test_final_touch(doubletten_df):
+    result = final_touch(doubletten_df, COLS_TO_KEEP)
+    # cluster_ids renumbered in order of appearance, then sorted
+    assert result["cluster_id"].tolist() == [1, 1, 2, 2, 2]
+    assert result["ReferenceID"].tolist() == ["A", "B", "C", "D", "E"]
+    # highest score, then newest CreatedAt
+    assert result["master"].tolist() == ["", "X", "", "X", ""]
+    assert result["masterID"].tolist() == ["B", "B", "D", "D", "D"]
+    assert "master" not in doubletten_df.columns
+
+
+def test_final_touch_empty(doubletten_df):
+    df = empty_frame(doubletten_df)
+    result = final_touch(df, COLS_TO_KEEP)
+    assert result.empty
+    assert list(result.columns) == COLS_TO_KEEP
+    assert "master" not in df.columns
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread", "process"])
+def test_final_touch_batch(doubletten_df, backend):
+    df_dict = {
+        "Produkt A": doubletten_df,
+        "Produkt B": {"exact": doubletten_df.iloc[2:], "empty": empty_frame(doubletten_df)},
+        "Produkt C": {},
+    }
+    result = final_touch_batch(df_dict, COLS_TO_KEEP, backend=backend, num_workers=2)
+
+    assert list(result) == list(df_dict)
+    pd.testing.assert_frame_equal(result["Produkt A"], final_touch(doubletten_df, COLS_TO_KEEP))
+    assert list(result["Produkt B"]) == ["exact", "empty"]
+    pd.testing.assert_frame_equal(result["Produkt B"]["exact"], final_touch(doubletten_df.iloc[2:], COLS_TO_KEEP))
+    assert result["Produkt B"]["empty"].empty
+    assert result["Produkt C"] == {}
+
+
+def test_renumber_pairs():
+    assert renumber_pairs(pd.Series([3, 3, 1, 1, 8])).tolist() == [1, 1, 2, 2, 3]
+
+
+def test_renumber_and_sort_alphanumeric():
+    df = pd.DataFrame({"cluster_id": ["12_b", "3_a", "12_a", "3_b"], "x": range(4)})
+    result = renumber_and_sort_alphanumeric(df)
+    assert result["cluster_id"].tolist() == ["1_a", "1_b", "2_a", "2_b"]
+    assert result["x"].tolist() == [1, 3, 2, 0]
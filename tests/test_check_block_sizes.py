@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from helper_functions.cleanup_functions import check_block_sizes
+
+
+@pytest.fixture
+def contacts_df():
+    # one placeholder number shared by 6 rows (30 pairs), two normal blocks of 2 (2 pairs each), one single
+    numbers = ["000"] * 6 + ["111", "111", "222", "222", "333"]
+    return pd.DataFrame({"Telefonnummer": numbers, "ReferenceID": range(len(numbers))})
+
+
+def test_within_budget(contacts_df):
+    df, report = check_block_sizes(contacts_df, "Telefonnummer", max_pairs=34)
+    assert report.empty
+    assert df is contacts_df
+
+
+def test_total_budget_raises(contacts_df):
+    with pytest.raises(ValueError, match="1 oversized blocks with 30 of 34 predicted pairs"):
+        check_block_sizes(contacts_df, "Telefonnummer", max_pairs=10)
+
+
+def test_per_block_budget_caps(contacts_df):
+    df, report = check_block_sizes(
+        contacts_df, "Telefonnummer", max_pairs=None, max_block_size=5, on_oversized="cap"
+    )
+    assert report[["key", "block_size", "pairs"]].values.tolist() == [["000", 6, 30]]
+    assert "000" not in set(df["Telefonnummer"])
+    assert len(df) == 5
+
+
+def test_ignore_only_reports(contacts_df):
+    df, report = check_block_sizes(contacts_df, "Telefonnummer", max_pairs=3, on_oversized="ignore")
+    assert len(report) == 2
+    assert df is contacts_df
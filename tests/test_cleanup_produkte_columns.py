@@ -0,0 +1,120 @@
+import random
+
+import pandas as pd
+import pytest
+
+from helper_functions.filter_muster_organisationen import (
+    cleanup_produkte_columns,
+    cleanup_produkte_columns_only_2_roles,
+)
+
+
+# Row-wise versions from before the vectorization, used as reference.
+def reference_cleanup_produkte_columns(df, group_columns="cluster_id"):
+    def check_group(group):
+        if (
+            group["Inhaber_Objekt"].apply(len).sum() == 0
+            and group["Korrempf_Objekt"].apply(len).sum() == 0
+        ):
+            return False
+
+        all_inhaber = [item for sublist in group["Inhaber_Objekt"] for item in sublist]
+        all_korrempf = [item for sublist in group["Korrempf_Objekt"] for item in sublist]
+        all_rechempf = [item for sublist in group["Rechempf_Objekt"] for item in sublist]
+        unique_items = set(all_inhaber + all_rechempf + all_korrempf)
+
+        for item in unique_items:
+            if all_inhaber.count(item) != 1 or all_korrempf.count(item) != 1:
+                return False
+            if all_rechempf.count(item) != 1:
+                return False
+        return True
+
+    return df.groupby(group_columns).filter(check_group)
+
+
+def reference_cleanup_produkte_columns_only_2_roles(df, group_columns="cluster_id"):
+    def check_group(group):
+        if (
+            all(group["Inhaber_Objekt"].apply(len) == 0)
+            and all(group["Korrempf_Objekt"].apply(len) == 0)
+            and all(group["Rechempf_Objekt"].apply(len) == 0)
+        ):
+            return False
+
+        all_inhaber = [item for sublist in group["Inhaber_Objekt"] for item in sublist]
+        all_korrempf = [item for sublist in group["Korrempf_Objekt"] for item in sublist]
+        all_rechempf = [item for sublist in group["Rechempf_Objekt"] for item in sublist]
+        unique_items = set(all_inhaber + all_rechempf + all_korrempf)
+
+        for item in unique_items:
+            count = (item in all_inhaber) + (item in all_korrempf) + (item in all_rechempf)
+            if count != 2:
+                return False
+        return True
+
+    return df.groupby(group_columns).filter(check_group)
+
+
+@pytest.fixture
+def produkte_df():
+    # Hand-written groups for the edge cases, followed by random groups.
+    rows = [
+        # 0: all roles once -> kept by cleanup_produkte_columns
+        (0, "A", ["o1"], ["o1"], ["o1"]),
+        # 1: roles distributed over two members
+        (1, "A", ["o2"], [], ["o2"]),
+        (1, "A", [], ["o2"], []),
+        # 2: all lists empty
+        (2, "A", [], [], []),
+        (2, "A", [], [], []),
+        # 3: Inhaber twice
+        (3, "A", ["o3"], ["o3"], ["o3"]),
+        (3, "A", ["o3"], [], []),
+        # 4: exactly two roles -> kept by cleanup_produkte_columns_only_2_roles
+        (4, "A", ["o4"], [], ["o4"]),
+        # 5: same cluster_id, two products
+        (5, "A", ["o5"], ["o5"], ["o5"]),
+        (5, "B", ["o6"], ["o6"], []),
+        # missing cluster_id
+        (None, "A", ["o7"], ["o7"], ["o7"]),
+    ]
+    rnd = random.Random(0)
+    items = ["x1", "x2", "x3"]
+    for _ in range(80):
+        rows.append(
+            (
+                rnd.randrange(6, 30),
+                rnd.choice("AB"),
+                *[[rnd.choice(items) for _ in range(rnd.choice([0, 0, 1, 1, 2]))] for _ in range(3)],
+            )
+        )
+    df = pd.DataFrame(
+        rows, columns=["cluster_id", "FullID", "Inhaber_Objekt", "Rechempf_Objekt", "Korrempf_Objekt"]
+    )
+    df.index = rnd.sample(range(1000), len(df))
+    return df
+
+
+@pytest.mark.parametrize("group_columns", ["cluster_id", ["FullID", "cluster_id"]])
+@pytest.mark.parametrize(
+    "function, reference",
+    [
+        (cleanup_produkte_columns, reference_cleanup_produkte_columns),
+        (cleanup_produkte_columns_only_2_roles, reference_cleanup_produkte_columns_only_2_roles),
+    ],
+)
+def test_same_as_row_wise_version(produkte_df, group_columns, function, reference):
+    expected = reference(produkte_df, group_columns)
+    result = function(produkte_df, group_columns)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_hand_written_groups(produkte_df):
+    kept = cleanup_produkte_columns(produkte_df)
+    assert {0, 1}.issubset(set(kept["cluster_id"]))
+    assert not {2, 3, 4}.intersection(set(kept["cluster_id"]))
+
+    kept_2_roles = cleanup_produkte_columns_only_2_roles(produkte_df)
+    assert 4 in set(kept_2_roles["cluster_id"])
+    assert not {0, 2}.intersection(set(kept_2_roles["cluster_id"]))
@@ -0,0 +1,112 @@
+import itertools
+import random
+
+import pandas as pd
+import pytest
+
+from helper_functions.filter_muster_organisationen import (
+    apply_filter_spec,
+    general_exclusion_criteria,
+    general_exclusion_criteria_personen,
+    row_mask,
+)
+
+
+# Row-wise versions from before the filter spec, used as reference.
+def reference_general_exclusion_criteria(
+    df, no_Produkte=True, no_Geschaeftspartner=True, no_Servicerole=True, only_with_Geschaeftspartner=False
+):
+    if no_Produkte:
+        df = df[((df["Produkt_Inhaber"] == 0) & (df["Produkt_Adressant"] == 0))]
+    if no_Geschaeftspartner:
+        df = df[~df["Geschaeftspartner_list"].apply(lambda gp: len(gp) != 0)]
+    if no_Servicerole:
+        df = df[df["Servicerole_count"] == 0]
+    if only_with_Geschaeftspartner:
+        df = df.groupby("cluster_id").filter(
+            lambda x: x["Geschaeftspartner_list"].apply(lambda gp: len(gp) > 0).any()
+        )
+    return df[df.groupby("cluster_id")["cluster_id"].transform("size") >= 2]
+
+
+def reference_general_exclusion_criteria_personen(
+    df,
+    no_Produkte=True,
+    no_Geschaeftspartner=True,
+    no_Servicerole=True,
+    only_physisch=False,
+    only_mitarbeiter=True,
+    only_with_Geschaeftspartner=False,
+):
+    if no_Produkte:
+        df = df[df["Produkt_rolle"].apply(lambda x: len(x) == 0)]
+    if no_Geschaeftspartner:
+        df = df[df["Geschaeftspartner_list"].apply(lambda gp: len(gp) == 0)]
+    if no_Servicerole:
+        df = df[df["Servicerole_string"] == ""]
+    if only_physisch:
+        df = df[df["Versandart"] == "Physisch"]
+    else:
+        df = df[(df["Versandart"] == "Physisch") | (df["Versandart"] == "Portal")]
+    allowed = ["Mitarbeiter"] if only_mitarbeiter else ["Mitarbeiter", "Administrator"]
+    df = df[df["Verknuepfungsart_list"].apply(lambda x: len(x) == 1 and x[0] in allowed)]
+    if only_with_Geschaeftspartner:
+        df = df.groupby("cluster_id").filter(
+            lambda x: x["Geschaeftspartner_list"].apply(lambda gp: len(gp) > 0).any()
+        )
+    return df.groupby("cluster_id").filter(lambda x: len(x) > 1)
+
+
+@pytest.fixture
+def members_df():
+    rnd = random.Random(4)
+    n = 400
+    return pd.DataFrame(
+        {
+            "cluster_id": [rnd.choice([0, 1, 2, 3, 4, 5, None]) for _ in range(n)],
+            "Produkt_Inhaber": [rnd.choice([0, 0, 1]) for _ in range(n)],
+            "Produkt_Adressant": [rnd.choice([0, 0, 2]) for _ in range(n)],
+            "Geschaeftspartner_list": [rnd.choice([[], [], ["g"]]) for _ in range(n)],
+            "Servicerole_count": [rnd.choice([0, 0, 1]) for _ in range(n)],
+            "Produkt_rolle": [rnd.choice([[], [], ["p"]]) for _ in range(n)],
+            "Servicerole_string": [rnd.choice(["", "", "x"]) for _ in range(n)],
+            "Versandart": [rnd.choice(["Physisch", "Portal", "Other"]) for _ in range(n)],
+            "Verknuepfungsart_list": [
+                rnd.choice([[], ["Mitarbeiter"], ["Administrator"], ["Mitarbeiter", "Administrator"], ["Other"]])
+                for _ in range(n)
+            ],
+        },
+        index=rnd.sample(range(10**6), n),
+    )
+
+
+@pytest.mark.parametrize("flags", list(itertools.product([True, False], repeat=4)))
+def test_general_exclusion_criteria_same_as_row_wise_version(members_df, flags):
+    expected = reference_general_exclusion_criteria(members_df, *flags)
+    pd.testing.assert_frame_equal(general_exclusion_criteria(members_df, *flags), expected)
+
+
+@pytest.mark.parametrize("flags", list(itertools.product([True, False], repeat=6)))
+def test_general_exclusion_criteria_personen_same_as_row_wise_version(members_df, flags):
+    expected = reference_general_exclusion_criteria_personen(members_df, *flags)
+    pd.testing.assert_frame_equal(general_exclusion_criteria_personen(members_df, *flags), expected)
+
+
+def test_row_mask_list_operators():
+    df = pd.DataFrame({"values": [[], ["a"], ["b"], ["a", "b"]]})
+    assert row_mask(df, "values", "len==", 0).tolist() == [True, False, False, False]
+    assert row_mask(df, "values", "len>", 1).tolist() == [False, False, False, True]
+    assert row_mask(df, "values", "single_in", ["a"]).tolist() == [False, True, False, False]
+    with pytest.raises(ValueError, match="Unknown filter operator"):
+        row_mask(df, "values", "contains", "a")
+
+
+def test_apply_filter_spec_count_predicate():
+    df = pd.DataFrame(
+        {
+            "cluster_id": [1, 1, 1, 2, 2, 2, None],
+            "Versandart": ["Portal", "Portal", "Physisch", "Portal", "Physisch", "Physisch", "Portal"],
+        }
+    )
+    spec = {"groups": [(("count", ">=", 2), "Versandart", "==", "Portal")], "min_group_size": 3}
+    assert apply_filter_spec(df, spec).index.tolist() == [0, 1, 2]
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+from helper_functions.edges_clusters import find_fuzzy_name_adresse_doubletten, normalize_for_fuzzy_matching
+
+
+def organisationen_df(records):
+    return pd.DataFrame(
+        [(f"O{i}", name, address) for i, (name, address) in enumerate(records)],
+        columns=["ReferenceID", "Name_Zeile2", "address_full"],
+    )
+
+
+def clusters(result):
+    return sorted(sorted(group) for group in result.groupby("cluster_id")["ReferenceID"].agg(list))
+
+
+@pytest.mark.parametrize(
+    "records",
+    [
+        # typo
+        [("Muster AG", "Hauptstrasse 5, 3000 Bern"), ("Mustr AG", "Hauptstrasse 5, 3000 Bern")],
+        # street abbreviation
+        [("Muster AG", "Hauptstrasse 5, 3000 Bern"), ("Muster AG", "Hauptstr. 5, 3000 Bern")],
+        [("Muster AG", "Bahnhof-Str.1, 3000 Bern"), ("Muster AG", "Bahnhofstrasse 1, 3000 Bern")],
+        # both at once
+        [("Mustr AG", "Hauptstr. 5, 3000 Bern"), ("Muster AG", "Hauptstrasse 5, 3000 Bern")],
+        # word order
+        [("Beispiel GmbH Bern", "Weg 2, 3000 Bern"), ("Bern Beispiel GmbH", "Weg 2, 3000 Bern")],
+        # umlauts
+        [("Müller Söhne AG", "Weg 2, 8000 Zürich"), ("Mueller Soehne AG", "Weg 2, 8000 Zuerich")],
+    ],
+)
+def test_finds_variants(records):
+    result = find_fuzzy_name_adresse_doubletten(organisationen_df(records), num_processes=1)
+    assert clusters(result) == [["O0", "O1"]]
+
+
+def test_different_house_number_or_name_is_no_match():
+    df = organisationen_df(
+        [
+            ("Muster AG", "Hauptstrasse 5, 3000 Bern"),
+            ("Muster AG", "Hauptstrasse 7, 3000 Bern"),
+            ("Beispiel AG", "Hauptstrasse 5, 3000 Bern"),
+        ]
+    )
+    assert find_fuzzy_name_adresse_doubletten(df, num_processes=1).empty
+
+
+def test_normalize_street_abbreviations():
+    addresses = pd.Series(["Hauptstr. 5", "Haupt-Str.5", "Haupt Strasse 5", "Hauptstraße 5", "Strassenbau 5"])
+    assert normalize_for_fuzzy_matching(addresses, addresses=True).tolist() == [
+        "5 hauptstrasse", "5 hauptstrasse", "5 hauptstrasse", "5 hauptstrasse", "5 strassenbau"
+    ]
+    # names are not touched
+    assert normalize_for_fuzzy_matching(pd.Series(["Mustr AG"])).tolist() == ["ag mustr"]
+
+
+def test_oversized_blocks_are_reported(capsys):
+    df = organisationen_df(
+        [("Muster AG", "Hauptstrasse 5, 3000 Bern")] * 4 + [("Beispiel AG", "Weg 2, 3000 Bern")] * 2
+    )
+    result = find_fuzzy_name_adresse_doubletten(df, max_block_size=3, num_processes=1)
+    assert clusters(result) == [["O4", "O5"]]
+    output = capsys.readouterr().out
+    assert "1 oversized blocks" in output
+    assert "3000|3000 5|mus" in output
+
+    with pytest.raises(ValueError, match="oversized blocks"):
+        find_fuzzy_name_adresse_doubletten(df, max_block_size=3, on_oversized="raise", num_processes=1)
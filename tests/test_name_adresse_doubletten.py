@@ -0,0 +1,81 @@
+import random
+
+import pandas as pd
+import pytest
+
+from helper_functions.cleanup_functions import add_name_variant_keys
+from helper_functions.edges_clusters import abbreviate_first_name, find_name_adresse_doubletten
+
+
+# String-based version from before the hashed keys, used as reference.
+def reference_find_name_adresse_doubletten(df, organisationen=True, abbreviated_first_name=False):
+    if organisationen:
+        df['cluster_id'] = df.groupby(['Name_Zeile2', 'address_full']).ngroup()
+    elif abbreviated_first_name:
+        df["Name_abbrev"] = df["Name"].apply(abbreviate_first_name)
+        df['cluster_id'] = df.groupby(['Name_abbrev', 'address_full']).ngroup()
+    else:
+        df['cluster_id'] = df.groupby(['Name', 'address_full']).ngroup()
+    df = df[df.groupby('cluster_id')['cluster_id'].transform('size') > 1]
+    return df
+
+
+def clusters(df, name_column):
+    return {
+        frozenset(zip(group[name_column], group["ReferenceID"]))
+        for _, group in df.groupby("cluster_id")
+    }
+
+
+@pytest.fixture
+def personen_df():
+    rnd = random.Random(2)
+    names = ["hans muster", "hans  muster", "h. muster", "anna meier", "meier anna", "müller rené"]
+    addresses = ["hauptstrasse 1, 3000 bern", "bahnhofstrasse 2, 8000 zürich", None]
+    n = 300
+    return pd.DataFrame(
+        {
+            "ReferenceID": [f"P{i}" for i in range(n)],
+            "Name": [rnd.choice(names) for _ in range(n)],
+            "address_full": [rnd.choice(addresses) for _ in range(n)],
+        }
+    )
+
+
+def test_name_key_keeps_the_name_as_it_is():
+    df = add_name_variant_keys(
+        pd.DataFrame({"Name": ["Hans Muster", "Hans  Muster", None], "address_full": ["a", "a", "a"]})
+    )
+    assert df.loc[0, "name_key"] != df.loc[1, "name_key"]
+    assert df.loc[0, "name_key_normalized"] == df.loc[1, "name_key_normalized"]
+    assert pd.isna(df.loc[2, "name_key"]) and pd.isna(df.loc[2, "name_key_normalized"])
+
+
+@pytest.mark.parametrize("abbreviated_first_name", [False, True])
+def test_same_clusters_as_string_version(personen_df, abbreviated_first_name):
+    expected = reference_find_name_adresse_doubletten(
+        personen_df.copy(), organisationen=False, abbreviated_first_name=abbreviated_first_name
+    )
+    result = find_name_adresse_doubletten(
+        personen_df.copy(), organisationen=False, abbreviated_first_name=abbreviated_first_name
+    )
+    assert clusters(result, "Name") == clusters(expected, "Name")
+
+    # cluster_ids are 0, 1, ... in the order of the names and addresses
+    first_rows = result.sort_values(["Name", "address_full"], kind="stable").drop_duplicates("cluster_id")
+    assert first_rows["cluster_id"].tolist() == list(range(result["cluster_id"].nunique()))
+
+
+def test_same_cluster_order_as_string_version(personen_df):
+    expected = reference_find_name_adresse_doubletten(personen_df.copy(), organisationen=False)
+    result = find_name_adresse_doubletten(personen_df.copy(), organisationen=False)
+    order = lambda df: df.sort_values("ReferenceID").groupby("cluster_id")["ReferenceID"].first().tolist()
+    assert order(result) == order(expected)
+
+
+def test_normalized_variant_merges_whitespace(personen_df):
+    exact = find_name_adresse_doubletten(personen_df.copy(), organisationen=False)
+    normalized = find_name_adresse_doubletten(personen_df.copy(), organisationen=False, name_variant="normalized")
+    assert not (exact.groupby("cluster_id")["Name"].nunique() > 1).any()
+    merged = normalized.groupby("cluster_id")["Name"].agg(set)
+    assert {"hans muster", "hans  muster"} in merged.tolist()
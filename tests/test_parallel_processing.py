@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from helper_functions.parallel_processing import (
+    close_executor_pools,
+    execute_tasks,
+    get_executor_pool,
+    make_task_batches,
+)
+
+
+def square_plus(task, offset=0):
+    return task * task + offset
+
+
+def fail_on_three(task):
+    if task == 3:
+        raise ValueError("task 3 failed")
+    return task
+
+
+@pytest.fixture(autouse=True)
+def fresh_pools():
+    yield
+    close_executor_pools()
+
+
+def test_make_task_batches_covers_every_task_once():
+    weights = [100, 1, 1, 1, 1, 50, 2]
+    batches = make_task_batches(weights, 4)
+    positions = [position for batch in batches for position in batch]
+    assert sorted(positions) == list(range(len(weights)))
+    # largest first, huge tasks get their own batch, small ones are packed
+    assert batches[0] == [0]
+    assert batches[1] == [5]
+    assert len(batches) < len(weights)
+
+
+def test_make_task_batches_empty():
+    assert make_task_batches([], 4) == []
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread", "process"])
+@pytest.mark.parametrize("tasks_per_worker", [4, None])
+def test_execute_tasks_keeps_task_order(backend, tasks_per_worker):
+    tasks = list(range(20))
+    weights = [(task * 7) % 5 + 1 for task in tasks]
+    results = execute_tasks(
+        square_plus,
+        tasks,
+        weights=weights,
+        backend=backend,
+        num_workers=2,
+        tasks_per_worker=tasks_per_worker,
+        progress=False,
+        offset=1,
+    )
+    assert results == [task * task + 1 for task in tasks]
+
+
+def test_execute_tasks_empty():
+    assert execute_tasks(square_plus, [], progress=False) == []
+
+
+def test_execute_tasks_raises_worker_errors():
+    with pytest.raises(ValueError, match="task 3 failed"):
+        execute_tasks(fail_on_three, range(6), backend="thread", num_workers=2, progress=False)
+
+
+def test_prepare_is_bounded_by_the_window():
+    # prepare() must not run for all tasks up front, at most 2 batches per worker are prepared or running.
+    num_workers = 2
+    lock = threading.Lock()
+    state = {"prepared": 0, "finished": 0, "max_open": 0}
+
+    def prepare(task):
+        with lock:
+            state["prepared"] += 1
+            state["max_open"] = max(state["max_open"], state["prepared"] - state["finished"])
+        return task
+
+    def slow(task):
+        time.sleep(0.01)
+        with lock:
+            state["finished"] += 1
+        return task
+
+    results = execute_tasks(
+        slow, range(16), backend="thread", num_workers=num_workers, tasks_per_worker=None,
+        prepare=prepare, progress=False,
+    )
+    assert results == list(range(16))
+    assert state["prepared"] == 16
+    assert state["max_open"] <= 2 * num_workers
+
+
+def test_get_executor_pool_is_reused_and_closed():
+    pool = get_executor_pool("thread", 2)
+    assert get_executor_pool("thread", 2) is pool
+    assert get_executor_pool("thread", 3) is not pool
+    close_executor_pools()
+    assert get_executor_pool("thread", 2) is not pool
+
+
+def test_get_executor_pool_unknown_backend():
+    with pytest.raises(ValueError, match="Unknown backend"):
+        get_executor_pool("gpu")
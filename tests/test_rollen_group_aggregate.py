@@ -0,0 +1,28 @@
+import pandas as pd
+
+from helper_functions.edges_clusters import (
+    organisationsrollen_group_aggregate,
+    personenrollen_group_aggregate,
+)
+
+
+def test_produktgruppe_ids_differ_between_tables():
+    # same IDs in the same positions, only the role columns differ
+    values = {"FullID": ["F1", "F1", "F2"], "Produkt_RefID": ["Q1", "Q2", "Q3"]}
+    ids = [["A", "A", "C"], ["B", "B", "B"], ["C", "C", "A"]]
+    organisationsrollen = pd.DataFrame(
+        dict(values, Inhaber_RefID=ids[0], Rechnungsempfaenger_RefID=ids[1], Korrespondenzempfaenger_RefID=ids[2])
+    )
+    personenrollen = pd.DataFrame(
+        dict(values, Kontaktperson_RefID=ids[0], Technikperson_RefID=ids[1], Statistikperson_RefID=ids[2])
+    )
+
+    organisationen_ids = organisationsrollen_group_aggregate(organisationsrollen)["Produktgruppe_ID"]
+    personen_ids = personenrollen_group_aggregate(personenrollen)["Produktgruppe_ID"]
+
+    assert len(organisationen_ids) == 2 and organisationen_ids.is_unique
+    assert set(organisationen_ids).isdisjoint(personen_ids)
+    # stable across runs
+    assert organisationen_ids.tolist() == organisationsrollen_group_aggregate(organisationsrollen)[
+        "Produktgruppe_ID"
+    ].tolist()
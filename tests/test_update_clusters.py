@@ -0,0 +1,68 @@
+import random
+
+import pandas as pd
+import pytest
+
+from helper_functions.edges_clusters import find_clusters_all, update_clusters
+
+
+def make_edges(pairs):
+    return pd.DataFrame(
+        [(f"N{source}", f"N{target}", "Telefon") for source, target in pairs],
+        columns=["source", "target", "match_type"],
+    )
+
+
+def partition(cluster_df):
+    return {frozenset(nodes) for nodes in cluster_df["nodes"]}
+
+
+@pytest.fixture
+def random_pairs():
+    rnd = random.Random(1)
+    return [tuple(rnd.sample(range(200), 2)) for _ in range(150)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_same_as_full(random_pairs, seed):
+    rnd = random.Random(seed)
+    special_nodes = {"N0"}
+    old_edges = make_edges(random_pairs)
+    old_clusters = find_clusters_all(old_edges, special_nodes)
+
+    # remove some edges, add some new ones (also to nodes that did not exist before)
+    removed = rnd.sample(random_pairs, 10)
+    added = [tuple(rnd.sample(range(250), 2)) for _ in range(10)]
+    new_pairs = [pair for pair in random_pairs if pair not in removed] + added
+    new_edges = make_edges(new_pairs)
+    dirty_nodes = {f"N{node}" for pair in removed + added for node in pair}
+
+    updated = update_clusters(old_clusters, new_edges, dirty_nodes, special_nodes)
+    full = find_clusters_all(new_edges, special_nodes)
+
+    assert partition(updated) == partition(full)
+    assert updated["cluster_id"].is_unique
+    assert updated["cluster_id"].is_monotonic_increasing
+
+    sizes = dict(zip(map(frozenset, full["nodes"]), full["cluster_size"]))
+    assert all(sizes[frozenset(nodes)] == size for nodes, size in zip(updated["nodes"], updated["cluster_size"]))
+
+    # clusters without dirty nodes keep their cluster_id
+    for cluster_id, nodes in zip(old_clusters["cluster_id"], old_clusters["nodes"]):
+        if dirty_nodes.isdisjoint(nodes):
+            assert updated.loc[updated["cluster_id"] == cluster_id, "nodes"].map(frozenset).tolist() == [
+                frozenset(nodes)
+            ]
+
+
+def test_only_deleted_nodes(random_pairs):
+    # all edges of a cluster removed: nothing is recomputed, the cluster is dropped
+    old_edges = make_edges(random_pairs + [(500, 501)])
+    old_clusters = find_clusters_all(old_edges, set())
+    new_edges = make_edges(random_pairs)
+
+    updated = update_clusters(old_clusters, new_edges, {"N500", "N501"}, set())
+
+    assert partition(updated) == partition(find_clusters_all(new_edges, set()))
+    assert updated.index.tolist() == list(range(len(updated)))
+    assert updated["cluster_id"].is_monotonic_increasing